@@ -0,0 +1,588 @@
+# ===================================================================
+# OFFLINE BENCHMARK HARNESS
+#
+# Drives the handlers in main.py with synthetic Discord objects, a fake
+# REST layer (channels that just count sends) and local stub servers for
+# the Steam and joke APIs. No Discord connection or API keys are needed.
+#
+# Usage:
+#   python benchmark.py                         # all scenarios
+#   python benchmark.py --scenarios message presence --rate 2000 --duration 5
+#   python benchmark.py --json baseline.json    # save results
+#   python benchmark.py --compare baseline.json # show change vs. a saved run
+# ===================================================================
+
+import argparse
+import array
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import wave
+
+from aiohttp import web
+import discord
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+GUILD_ID = 1000
+MAIN_CHANNEL_ID = 2000
+VOICE_CHANNEL_ID = 3000
+NUM_MEMBERS = 200
+STUB_HOST = "127.0.0.1"
+
+
+# --- Synthetic Discord objects (only the attributes main.py uses) ---
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild=None, name: str = "channel", rest_latency: float = 0.0):
+        self.id = channel_id
+        self.guild = guild
+        self.name = name
+        self.rest_latency = rest_latency
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        # Fake REST call: optionally wait like a real round-trip, then count it
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency)
+        self.sent += 1
+
+class FakeVoiceState:
+    def __init__(self, channel=None):
+        self.channel = channel
+        self.mute = False
+        self.self_mute = False
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.members = {}
+        self.voice_client = None
+        self.me = types.SimpleNamespace(voice=None)
+
+    def get_member(self, member_id: int):
+        return self.members.get(member_id)
+
+class FakeMember:
+    def __init__(self, member_id: int, guild: FakeGuild):
+        self.id = member_id
+        self.name = f"member{member_id}"
+        self.display_name = self.name
+        self.bot = False
+        self.guild = guild
+        self.voice = None
+        self.activities = ()
+        self.mention = f"<@{member_id}>"
+
+    async def send(self, content=None, **kwargs):
+        pass
+
+class FakeMessage:
+    def __init__(self, author: FakeMember, content: str, channel: FakeChannel):
+        self.author = author
+        self.content = content
+        self.channel = channel
+
+class FakeResponse:
+    async def send_message(self, content=None, **kwargs):
+        pass
+
+    async def defer(self, **kwargs):
+        pass
+
+class FakeFollowup:
+    async def send(self, content=None, **kwargs):
+        pass
+
+class FakeInteraction:
+    def __init__(self, user: FakeMember, guild: FakeGuild):
+        self.user = user
+        self.guild = guild
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+# --- Environment setup ---
+
+def load_main(workdir: str, num_steam_users: int):
+    # main.py needs a config module; build one from config.py.example with synthetic IDs
+    config = types.ModuleType("config")
+    config.__file__ = os.path.join(BOT_DIR, "config.py.example")
+    with open(config.__file__, encoding="utf-8") as f:
+        exec(compile(f.read(), config.__file__, "exec"), config.__dict__)
+    config.GUILD_ID = GUILD_ID
+    config.MAIN_CHANNEL_ID = MAIN_CHANNEL_ID
+    config.STEAM_IDS = {member_id: 76561190000000000 + member_id for member_id in range(1, num_steam_users + 1)}
+    sys.modules["config"] = config
+
+    # Keep sounds/, the PCM cache and reminders.db out of the repository
+    os.chdir(workdir)
+    os.environ.pop("DISCORD_TOKEN", None)
+    sys.path.insert(0, BOT_DIR)
+    import main
+    return main
+
+def write_sounds(directory: str, count: int):
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(1)
+    silence = b"\x00\x00" * 2 * 4800 # 0.1 s of 48 kHz stereo
+    for _ in range(count):
+        name = "".join(rng.choice(string.ascii_letters + "_") for _ in range(rng.randint(4, 16)))
+        with wave.open(os.path.join(directory, f"{name}.wav"), "wb") as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(48000)
+            wav.writeframes(silence)
+
+async def start_stub_server(main):
+    # Local stand-ins for the Steam and joke APIs
+    games = ["Halo Infinite", "Rocket League", "Counter-Strike 2", "EA SPORTS FIFA 23", "Some Indie Game"]
+
+    async def player_summaries(request):
+        players = [
+            {"steamid": steam_id, "gameextrainfo": random.choice(games)}
+            for steam_id in request.query.get("steamids", "").split(",") if steam_id
+        ]
+        return web.json_response({"response": {"players": players}})
+
+    async def joke(request):
+        return web.json_response([{"text": f"Joke #{random.randint(1, 10**6)}"}])
+
+    app = web.Application()
+    app.router.add_get("/ISteamUser/GetPlayerSummaries/v0002/", player_summaries)
+    app.router.add_get("/api/joke", joke)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, STUB_HOST, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    # Point the bot's API calls at the stub and lift the production rate limits
+    main.STEAM_API_HOST = f"{STUB_HOST}:{port}"
+    main.http_client.configure_host(STUB_HOST, rate=100000, capacity=1000)
+    main.joke_buffer.url = f"http://{STUB_HOST}:{port}/api/joke"
+    return runner
+
+def build_world(main, rest_latency: float):
+    guild = FakeGuild(GUILD_ID)
+    channel = FakeChannel(MAIN_CHANNEL_ID, guild, "main", rest_latency)
+    voice_channel = FakeChannel(VOICE_CHANNEL_ID, guild, "voice", rest_latency)
+    for member_id in range(1, NUM_MEMBERS + 1):
+        guild.members[member_id] = FakeMember(member_id, guild)
+
+    channels = {channel.id: channel, voice_channel.id: voice_channel}
+    main.bot.get_channel = channels.get
+    main.bot.get_user = guild.get_member
+    return guild, channel, voice_channel
+
+
+# --- Measurement ---
+
+def rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+async def drive(make_call, rate: float, duration: float):
+    # Calls make_call() at `rate` calls per second (0 = back to back) for `duration`
+    # seconds and returns the latency of every call
+    latencies = []
+    pending = set()
+
+    async def timed_call():
+        start = time.perf_counter()
+        await make_call()
+        latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - started < duration:
+        if rate:
+            target = started + sent / rate
+            delay = target - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.ensure_future(timed_call())
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        else:
+            await timed_call()
+            if sent % 100 == 0:
+                await asyncio.sleep(0) # Let background tasks (dispatchers etc.) run
+        sent += 1
+    if pending:
+        await asyncio.gather(*pending)
+    return latencies, time.perf_counter() - started
+
+def summarize(name: str, latencies, elapsed: float, rss_before: int, rss_after: int):
+    ordered = sorted(latencies)
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+    return {
+        "scenario": name,
+        "events": len(latencies),
+        "events_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(0.50) * 1000,
+        "p99_ms": percentile(0.99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "rss_growth_kb": rss_after - rss_before,
+    }
+
+
+# --- Scenarios ---
+
+async def scenario_message(main, world, args):
+    guild, channel, _ = world
+    contents = ["hello there", "uwu what is this", "nya~", "just some longer message " * 5, "ok"]
+    members = list(guild.members.values())
+    async def call():
+        await main.on_message(FakeMessage(random.choice(members), random.choice(contents), channel))
+    return await drive(call, args.rate, args.duration)
+
+def load_presence_trace(path: str):
+    # A recorded presence stream, one update per line:
+    # {"member_id": 1, "activities": [{"type": "playing", "name": "Fortnite"},
+    #                                 {"type": "listening", "name": "Spotify", "state": "..."}]}
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def trace_activity(entry: dict):
+    kind = entry.get("type", "playing")
+    if kind == "playing":
+        return discord.Game(entry["name"])
+    return discord.Activity(type=discord.ActivityType[kind], name=entry["name"], state=entry.get("state"))
+
+async def scenario_presence(main, world, args):
+    # Replays a presence stream: mostly Spotify/rich-presence churn, some game
+    # starts, or the updates recorded in --presence-trace
+    guild, _, voice_channel = world
+    members = list(guild.members.values())
+    for member in members:
+        member.voice = FakeVoiceState(voice_channel)
+    games = [discord.Game(name) for name in ("Notepad++", "Fortnite", "Minecraft", "Halo Infinite")]
+    def spotify():
+        return discord.Activity(type=discord.ActivityType.listening, name="Spotify", state=str(random.random()))
+    def synthetic_update():
+        activities = (spotify(),) + ((random.choice(games),) if random.random() < 0.3 else ())
+        return random.choice(members), activities
+
+    trace = None
+    if args.presence_trace:
+        # Members from the recording join the synthetic guild on first sight
+        trace = [(update["member_id"], tuple(map(trace_activity, update.get("activities", ()))))
+                 for update in args.presence_trace]
+        for member_id, _ in trace:
+            if member_id not in guild.members:
+                guild.members[member_id] = FakeMember(member_id, guild)
+                guild.members[member_id].voice = FakeVoiceState(voice_channel)
+    position = 0
+    def traced_update():
+        nonlocal position
+        member_id, activities = trace[position % len(trace)]
+        position += 1
+        return guild.members[member_id], activities
+
+    next_update = traced_update if trace else synthetic_update
+    async def call():
+        member, activities = next_update()
+        before = types.SimpleNamespace(activities=member.activities)
+        member.activities = activities
+        await main.on_presence_update(before, member)
+    return await drive(call, args.rate, args.duration)
+
+async def scenario_voice(main, world, args):
+    # Members flapping in and out of voice; latency is measured from the raw
+    # event to the end of the coalesced transition handler
+    guild, _, voice_channel = world
+    members = list(guild.members.values())
+    finished = {}
+    handler = main.voice_event_coalescer.handler
+
+    async def measured_handler(member, before, after):
+        await handler(member, before, after)
+        future = finished.pop(member.id, None)
+        if future and not future.done():
+            future.set_result(None)
+
+    main.voice_event_coalescer.handler = measured_handler
+    main.voice_event_coalescer.window = args.voice_window
+    try:
+        async def call():
+            member = random.choice(members)
+            before = FakeVoiceState(member.voice.channel if member.voice else None)
+            member.voice = None if before.channel else FakeVoiceState(voice_channel)
+            after = FakeVoiceState(member.voice.channel if member.voice else None)
+            if member.id not in finished:
+                finished[member.id] = asyncio.get_running_loop().create_future()
+            future = finished[member.id]
+            await main.on_voice_state_update(member, before, after)
+            await future
+        return await drive(call, args.rate, args.duration)
+    finally:
+        main.voice_event_coalescer.handler = handler
+
+async def scenario_witz(main, world, args):
+    guild, _, _ = world
+    main.joke_buffer.start()
+    await asyncio.sleep(0.2) # Let the buffer fill from the stub
+    user = guild.members[1]
+    async def call():
+        await main.witz.callback(FakeInteraction(user, guild))
+    return await drive(call, args.rate, args.duration)
+
+async def scenario_choose(main, world, args):
+    guild, _, _ = world
+    user = guild.members[1]
+    async def call():
+        await main.choose.callback(FakeInteraction(user, guild), "pizza pasta burger sushi")
+    return await drive(call, args.rate, args.duration)
+
+async def scenario_reminder(main, world, args):
+    guild, _, _ = world
+    main.reminder_scheduler.start()
+    users = list(guild.members.values())
+    async def call():
+        due = time.localtime(time.time() + random.randint(3600, 30 * 24 * 3600))
+        await main.reminder.callback(
+            FakeInteraction(random.choice(users), guild),
+            time.strftime("%Y-%m-%d", due), time.strftime("%H:%M", due), "benchmark reminder",
+        )
+    return await drive(call, args.rate, args.duration)
+
+async def scenario_reminder_reload(main, world, args):
+    # Startup reload of a store with --reminders pending reminders (latency is
+    # one full reload), plus the Python memory a loaded store keeps per reminder
+    path = "reload-benchmark.db"
+    rng = random.Random(4)
+    now = time.time()
+    store = main.MemoryStateStore(path)
+    def seed():
+        db = store._open()
+        db.executemany(
+            "INSERT INTO reminders (user_id, due_at, message) VALUES (?, ?, ?)",
+            ((rng.randint(1, NUM_MEMBERS), now + rng.uniform(60, 365 * 86400), "benchmark reminder")
+             for _ in range(args.reminders)),
+        )
+        db.commit()
+    await store._run(seed)
+    await store.close()
+
+    loaded = main.MemoryStateStore(path)
+    tracemalloc.start()
+    traced_before, _ = tracemalloc.get_traced_memory()
+    await loaded._reminders()
+    traced_after, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    pending = await loaded.count_reminders()
+    retained = traced_after - traced_before
+
+    async def call():
+        store = main.MemoryStateStore(path)
+        await store._reminders()
+        await store.close()
+    latencies, elapsed = await drive(call, args.rate, args.duration)
+    await loaded.close()
+    return latencies, elapsed, {
+        "reminders": pending,
+        "retained_kb": retained // 1024,
+        "peak_kb": (traced_peak - traced_before) // 1024,
+        "bytes_per_reminder": retained / pending if pending else 0.0,
+    }
+
+async def scenario_autocomplete(main, world, args):
+    guild, _, _ = world
+    # Build the index without refresh(), which would also start decoding every sound
+    main.sound_catalogue._apply(await asyncio.to_thread(main.sound_catalogue._read_directory, {}))
+    names = list(main.sound_catalogue.sounds) or ["sound"]
+    user = guild.members[1]
+    async def call():
+        name = random.choice(names)
+        start = random.randint(0, max(0, len(name) - 1))
+        await main.sound_autocomplete(FakeInteraction(user, guild), name[start:start + random.randint(0, 4)])
+    return await drive(call, args.rate, args.duration)
+
+async def scenario_steam(main, world, args):
+    # Latency here is one full poll cycle for all voice users
+    guild, channel, voice_channel = world
+    for member_id in main.config.STEAM_IDS:
+        guild.members[member_id].voice = FakeVoiceState(voice_channel)
+        await main.state_store.hsetnx(main.STEAM_MONITORS_KEY, member_id, "leer")
+    # The real poller (started by the voice scenario's joins) would spin for
+    # the rest of the run without a poll interval, so stop it and drive the
+    # cycles directly
+    poll_interval = main.STEAM_API_POLL_INTERVAL
+    main.STEAM_API_POLL_INTERVAL = 0
+    poller = main.steam_api_instance.poller_task
+    if poller:
+        poller.cancel()
+    async def call():
+        cycles = main.steam_api_instance.poll_cycles
+        task = asyncio.ensure_future(main.steam_api_instance.poll_steam_presences(channel.id))
+        while main.steam_api_instance.poll_cycles == cycles and not task.done():
+            await asyncio.sleep(0)
+        task.cancel()
+    try:
+        return await drive(call, 0, args.duration)
+    finally:
+        main.STEAM_API_POLL_INTERVAL = poll_interval
+
+async def scenario_stats(main, world, args):
+    # /stats and /topgames against a year of synthetic game history
+    guild, _, _ = world
+    users = list(guild.members.values())
+    games = [f"Game {index}" for index in range(30)]
+    rng = random.Random(2)
+    now = time.time()
+    for day in range(args.history_days, 0, -1):
+        for user in users:
+            start = now - day * 86400 + rng.randint(0, 80000)
+            for _ in range(rng.randint(0, 3)):
+                main.game_history.observe(user.id, rng.choice(games), start)
+                start += rng.randint(600, 4 * 3600)
+                main.game_history.observe(user.id, None, start)
+    await main.game_history.flush()
+    async def call():
+        if rng.random() < 0.5:
+            await main.stats.callback(FakeInteraction(rng.choice(users), guild), None, rng.choice((None, 7, 30)))
+        else:
+            await main.topgames.callback(FakeInteraction(rng.choice(users), guild), rng.choice((7, 30, 365)))
+    return await drive(call, args.rate, args.duration)
+
+async def scenario_mixer(main, world, args):
+    # One 20 ms MixerSource.read() with --mixer-voices sounds overlapping at all
+    # times; loud enough that the limiter is working. The real-time budget is 20 ms.
+    rng = random.Random(3)
+    clip = array.array("h", (rng.randint(-20000, 20000) for _ in range(2 * 48000))).tobytes() # 1 s of stereo noise
+    frame_size = main.discord.opus.Encoder.FRAME_SIZE
+    mixer = main.MixerSource(max_voices=args.mixer_voices)
+    async def call():
+        nonlocal mixer
+        while len(mixer.playing()) < args.mixer_voices:
+            # Start each sound at a different frame so they don't line up
+            offset = rng.randrange(len(clip) // frame_size) * frame_size
+            if not mixer.add(main.PCMBufferSource(clip[offset:]), "noise"):
+                mixer = main.MixerSource(max_voices=args.mixer_voices) # Ran dry, like after the last sound in a guild
+        mixer.read()
+    return await drive(call, 0, args.duration)
+
+SCENARIOS = {
+    "message": scenario_message,
+    "presence": scenario_presence,
+    "voice": scenario_voice,
+    "witz": scenario_witz,
+    "choose": scenario_choose,
+    "reminder": scenario_reminder,
+    "reminder_reload": scenario_reminder_reload,
+    "autocomplete": scenario_autocomplete,
+    "steam": scenario_steam,
+    "stats": scenario_stats,
+    "mixer": scenario_mixer,
+}
+
+
+# --- Runner ---
+
+SUMMARY_KEYS = ("scenario", "events", "events_per_sec", "p50_ms", "p99_ms", "mean_ms", "rss_growth_kb")
+
+def print_results(results, baseline=None):
+    baseline = {entry["scenario"]: entry for entry in baseline or []}
+    header = f"{'scenario':<16}{'events':>9}{'events/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'RSS +KB':>10}"
+    print(header)
+    print("-" * len(header))
+    for entry in results:
+        print(f"{entry['scenario']:<16}{entry['events']:>9}{entry['events_per_sec']:>12.0f}"
+              f"{entry['p50_ms']:>10.3f}{entry['p99_ms']:>10.3f}{entry['rss_growth_kb']:>10}")
+        old = baseline.get(entry["scenario"])
+        if old:
+            def change(key):
+                return f"{(entry[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else "n/a"
+            print(f"{'  vs baseline':<25}{change('events_per_sec'):>12}{change('p50_ms'):>10}{change('p99_ms'):>10}")
+        extra = {key: value for key, value in entry.items() if key not in SUMMARY_KEYS}
+        if extra:
+            print("  " + ", ".join(f"{key}={value:.0f}" for key, value in extra.items()))
+
+async def run(args):
+    # Everything the bot writes (sounds, PCM cache, SQLite files) goes into a
+    # temporary directory that is removed afterwards
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="dcbot-bench-", ignore_cleanup_errors=True) as workdir:
+        try:
+            return await run_scenarios(workdir, args)
+        finally:
+            os.chdir(original_dir)
+
+async def run_scenarios(workdir: str, args):
+    write_sounds(os.path.join(workdir, "sounds"), args.sounds)
+    main = load_main(workdir, args.steam_users)
+    main.bot.loop = asyncio.get_running_loop()
+    async def ready():
+        pass
+    main.bot.wait_until_ready = ready
+    main.OUTBOUND_COALESCE_WINDOW = args.coalesce_window
+    runner = await start_stub_server(main)
+    world = build_world(main, args.rest_latency)
+
+    results = []
+    try:
+        for name in args.scenarios:
+            rss_before = rss_kb()
+            # The bot logs with print(); keep that out of the report unless asked for
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                # A scenario may return a dict of extra measurements after its latencies
+                latencies, elapsed, *extra = await SCENARIOS[name](main, world, args)
+            await asyncio.sleep(0) # Let fire-and-forget work settle before measuring memory
+            entry = summarize(name, latencies, elapsed, rss_before, rss_kb())
+            for measurements in extra:
+                entry.update(measurements)
+            results.append(entry)
+    finally:
+        await runner.cleanup()
+        await main.http_client.close()
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline throughput/latency benchmark for the bot's handlers.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--rate", type=float, default=0, help="Events per second per scenario (0 = as fast as possible)")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds per scenario")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="Simulated Discord REST latency in seconds")
+    parser.add_argument("--coalesce-window", type=float, default=0.05, help="Outbound message merge window in seconds")
+    parser.add_argument("--voice-window", type=float, default=0.0, help="Voice event coalescing window in seconds")
+    parser.add_argument("--mixer-voices", type=int, default=8, help="Overlapping sounds in the mixer scenario")
+    parser.add_argument("--presence-trace", help="JSONL file of recorded presence updates to replay in the presence scenario")
+    parser.add_argument("--reminders", type=int, default=50000, help="Pending reminders in the reminder_reload scenario")
+    parser.add_argument("--history-days", type=int, default=365, help="Days of synthetic game history for /stats")
+    parser.add_argument("--sounds", type=int, default=3000, help="Number of synthetic sounds for autocomplete")
+    parser.add_argument("--steam-users", type=int, default=50, help="Members with a Steam ID")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own log output")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Compare against results saved with --json")
+    args = parser.parse_args()
+    # Read now: the scenarios run in a temporary working directory
+    if args.presence_trace:
+        args.presence_trace = load_presence_trace(args.presence_trace)
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -5,16 +5,32 @@ from discord.ext.commands import cooldown, BucketType
 from discord.ext import commands
 from discord import Game, app_commands
 from typing import List
-import requests # For the joke API
 import time
 from datetime import datetime
 import asyncio
 import json
 import socket
 import threading
+import traceback
 import aiohttp
+from urllib.parse import urlsplit
 import logging
 import sys
+import bisect
+import functools
+import math
+import importlib
+import heapq
+import re
+import hashlib
+import array
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+# Modules only some features need (sqlite3, wave, mmap, aiohttp.web, subprocess,
+# redis) are imported where they are used, so they cost nothing until then
+
+# Startup-to-ready is measured from here
+STARTUP_STARTED = time.monotonic()
 
 # --- NEW: Load the specific server configuration ---
 try:
@@ -31,22 +47,97 @@ except ImportError:
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 STEAM_API_KEY = os.getenv("STEAM_API_KEY")
 
-# Global flag to signal that a voice operation is in progress
-voice_operation_in_progress = False
+# Per-guild voice sessions {guild_id: VoiceSession}
+voice_sessions = {}
+VOICE_IDLE_DISCONNECT = 60 # Seconds the bot stays in voice after the last sound
+MIXER_MAX_VOICES = 8 # Sounds playing at the same time per guild; the oldest is cut off beyond that
+MIXER_LIMITER_RELEASE = 0.005 # Per 20 ms frame: how fast the volume recovers after the mix had to be turned down
 
-# Dictionary of active Steam monitor tasks {discord_user_id: asyncio.Task}
-active_steam_monitors = {}
+# Users watched by the central Steam poller live in the state store under this key
+# as {discord_user_id: last seen game name}
+STEAM_MONITORS_KEY = "steam:monitors"
 STEAM_API_POLL_INTERVAL = 300 # Seconds (5 minutes)
 STEAM_API_COOLDOWN_BETWEEN_CALLS = 60 # Seconds (1 minute)
+STEAM_API_JOIN_POLL_DELAY = 5 # Seconds from a join to the extra poll it triggers
+STEAM_API_MAX_IDS_PER_CALL = 100 # GetPlayerSummaries limit per request
+STEAM_API_HOST = "api.steampowered.com"
+
+# Outbound HTTP retry/backoff settings (shared by all API calls)
+HTTP_REQUEST_TIMEOUT = 10 # Seconds per attempt
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 1.0 # Seconds, doubled on every retry
+HTTP_BACKOFF_MAX = 60.0 # Seconds
+CIRCUIT_FAILURE_THRESHOLD = 5 # Consecutive failures before the circuit opens
+CIRCUIT_RESET_TIMEOUT = 120 # Seconds before a half-open trial request is allowed
+
+# Joke API (/witz)
+JOKE_API_URL = "https://witzapi.de/api/joke"
+JOKE_BUFFER_SIZE = 10 # Prefetched jokes kept in memory
+JOKE_CACHE_SIZE = 50 # Recently seen jokes kept as a fallback
+JOKE_CACHE_TTL = 6 * 60 * 60 # Seconds (6 hours)
+JOKE_LIVE_FETCH_TIMEOUT = 3 # Seconds /witz may wait when buffer and cache are empty
+JOKE_REFILL_RETRY_DELAY = 60 # Seconds between refill attempts while the API is down
+
+# Message triggers (on_message). Used when config.py does not define MESSAGE_TRIGGERS.
+DEFAULT_MESSAGE_TRIGGERS = [
+    {"keywords": ["uwu"], "reply": "UwU!"},
+    {"keywords": ["nya"], "reply": "Nyaaa~!"},
+]
+TRIGGER_CHANNEL_RATE = 5 # Max trigger replies per channel...
+TRIGGER_CHANNEL_PER = 30 # ...within this many seconds
+
+# Outbound channel messages
+OUTBOUND_COALESCE_WINDOW = 1.0 # Seconds to collect messages for one channel before sending
+OUTBOUND_QUEUE_SIZE = 100 # Max queued messages per channel
+DISCORD_MESSAGE_LIMIT = 2000 # Characters per message
+PRIORITY_REMINDER = 0 # Lower value = sent first, dropped last
+PRIORITY_NORMAL = 1
+PRIORITY_JOKE = 2
+
+# Presence jokes: the same game is not announced again for a member within this time
+PRESENCE_ANNOUNCE_TTL = 60 * 60 # Seconds (1 hour)
+PRESENCE_PRUNE_THRESHOLD = 10000 # Sweep expired entries once the store grows beyond this
+
+# config.py is checked this often for changes to the game reactions
+GAME_REACTIONS_RELOAD_INTERVAL = 30 # Seconds
+
+# Reminders are persisted here so they survive restarts
+REMINDER_DB_PATH = os.getenv("REMINDER_DB_PATH", "reminders.db")
+REMINDER_BATCH_SIZE = 50 # Max reminders delivered per dispatcher wake-up
+REMINDER_POLL_INTERVAL = 5 # Seconds between checks for reminders scheduled by other workers (cluster mode)
+REMINDER_RETRY_DELAY = 60 # Seconds before a reminder that could not be sent is tried again
+REMINDER_CLAIM_TIMEOUT = 300 # Seconds a claimed reminder stays with its worker before another may deliver it (cluster mode)
+
+# Steam game history (/stats, /topgames)
+GAME_HISTORY_DB_PATH = os.getenv("GAME_HISTORY_DB_PATH", "game_history.db")
+GAME_HISTORY_RETENTION_DAYS = int(os.getenv("GAME_HISTORY_RETENTION_DAYS", 90)) # Raw game changes kept this long (0 = forever)
+GAME_HISTORY_ROLLUP_RETENTION_DAYS = int(os.getenv("GAME_HISTORY_ROLLUP_RETENTION_DAYS", 365)) # Daily playtime kept this long (0 = forever)
+GAME_HISTORY_FLUSH_INTERVAL = 30 # Seconds between batched writes
+GAME_HISTORY_BATCH_SIZE = 500 # Flush early once this many changes are waiting
+GAME_HISTORY_COMPACT_INTERVAL = 24 * 60 * 60 # Seconds between retention/compaction runs
+
+# Sharding / cluster mode
+SHARD_COUNT = os.getenv("SHARD_COUNT") # Total number of shards, or "auto". Unset = one unsharded connection
+SHARD_IDS = os.getenv("SHARD_IDS") # Comma-separated shards run by this process (set by the cluster launcher)
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", 1)) # Worker processes the cluster launcher starts
+STATE_STORE_URL = os.getenv("STATE_STORE_URL") # redis://host:6379/0 to share state between workers; unset = in-memory
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}" # Owner name for cluster-wide locks
+LEADER_LOCK_TTL = 30 # Seconds a cluster-wide lock is held without being renewed
 
 # Path to sound files
-SOUNDS_DIR = "sounds"
-if not os.path.exists(SOUNDS_DIR):
-    os.makedirs(SOUNDS_DIR)
-    print(f"Directory '{SOUNDS_DIR}' was created. Please place your sound files here.")
+SOUNDS_DIR = "sounds" # Created at startup if missing
 
 WELCOME_SOUND = os.path.join(SOUNDS_DIR, "welcome.wav")
-SOUNDS_LIST = [] # Will be populated in on_ready()
+SOUND_EXTENSIONS = ('.wav', '.mp3') # In order of preference if a sound exists in both formats
+SOUND_RESCAN_INTERVAL = 10 # Seconds between checks of SOUNDS_DIR for new/changed files
+
+# Decoded sounds are cached here as raw 48 kHz stereo PCM (kept outside SOUNDS_DIR,
+# which may be mounted read-only)
+SOUND_CACHE_DIR = os.getenv("SOUND_CACHE_DIR", ".sound_cache")
+SOUND_CACHE_MAX_BYTES = 256 * 1024 * 1024 # Memory-mapped PCM kept in the LRU (256 MB)
+SOUND_TARGET_RMS = 3300 # Cached sounds are scaled towards this loudness (about -20 dBFS)...
+SOUND_MAX_GAIN = 4.0 # ...but quiet sounds are amplified by at most this factor
+SOUND_NORMALIZE_CHUNK_BYTES = 64 * 1024 # The gain pass holds the GIL for one chunk at a time
 
 # === NOTE: All GIF lists and STEAM_IDS are now loaded from config.py ===
 
@@ -68,48 +159,1900 @@ intents.voice_states = True
 def interaction_user_key(interaction: discord.Interaction) -> int:
     return interaction.user.id
 
-bot = commands.Bot(command_prefix=None, intents=intents)
+def create_bot() -> commands.Bot:
+    # Unsharded by default; SHARD_COUNT switches to AutoShardedBot, which runs all
+    # (or, in a cluster worker, the assigned) shards on this process' event loop
+    # The presence is sent with IDENTIFY, so reconnects don't need a change_presence call
+    options = dict(command_prefix=None, intents=intents, activity=activity, status=discord.Status.online)
+    if not SHARD_COUNT:
+        return commands.Bot(**options)
+    shard_count = None if SHARD_COUNT == "auto" else int(SHARD_COUNT)
+    shard_ids = [int(shard_id) for shard_id in SHARD_IDS.split(",")] if SHARD_IDS else None
+    return commands.AutoShardedBot(shard_count=shard_count, shard_ids=shard_ids, **options)
+
+bot = create_bot()
+
+# Port for the health/metrics HTTP server (cloud deployments set PORT)
+HEALTH_SERVER_PORT = int(os.environ.get("PORT", 8080))
+READY_MAX_GATEWAY_LATENCY = 10.0 # Seconds of heartbeat latency before /readyz fails
+LOOP_LAG_SAMPLE_INTERVAL = 0.5 # Seconds between event loop lag samples
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", 0.25)) # Seconds the loop may block before its stack is dumped
+# Opt-in sampling profiler: set PROFILE_OUTPUT to a file path to write
+# collapsed stacks (flamegraph.pl / speedscope format) of the event loop thread
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT")
+PROFILE_SAMPLE_INTERVAL = 0.01 # Seconds between profiler samples
+PROFILE_FLUSH_INTERVAL = 30 # Seconds between writes of the profile file
+HANDLER_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus-style histogram with one set of buckets per label combination
+class Histogram:
+    def __init__(self, name: str, description: str, buckets=HANDLER_LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {} # {labels tuple: [bucket counts..., count, sum]}
+
+    def observe(self, labels: tuple, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        index = bisect.bisect_left(self.buckets, value)
+        for i in range(index, len(self.buckets)):
+            series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self, label_names) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.series.items():
+            label_text = ",".join(f'{key}="{value}"' for key, value in zip(label_names, labels))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-2]}")
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-1]}")
+        return lines
+
+handler_latency = Histogram("dcbot_handler_duration_seconds", "Time spent in event handlers and slash commands.")
+
+# Records the run time of an event handler or command in handler_latency.
+# Goes below @bot.event / the app_commands decorators.
+def timed(kind: str, name: str = None):
+    def decorator(func):
+        metric_name = name or func.__name__
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                handler_latency.observe((kind, metric_name), time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# Measures how late the event loop wakes up from a short sleep. Anything that
+# blocks the loop shows up here. A watchdog thread also checks whether the
+# sampler is overdue by more than LOOP_STALL_THRESHOLD while the loop is still
+# blocked, and then prints the loop thread's stack so the blocking call can
+# be found.
+class EventLoopMonitor:
+    def __init__(self, interval: float = LOOP_LAG_SAMPLE_INTERVAL, stall_threshold: float = LOOP_STALL_THRESHOLD):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.next_wakeup = None # time.monotonic() at which the sampler should run next
+        self.loop_thread_id = None
+        self.task = None
+        self.watchdog = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.loop_thread_id = threading.get_ident()
+            self.task = asyncio.get_running_loop().create_task(self._sample())
+        if self.watchdog is None:
+            self.watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self.watchdog.start()
+
+    async def _sample(self):
+        while True:
+            self.next_wakeup = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, time.monotonic() - self.next_wakeup)
+            self.max_lag = max(self.max_lag, self.last_lag)
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(self.stall_threshold / 2)
+            next_wakeup = self.next_wakeup
+            if next_wakeup is None or next_wakeup == reported:
+                continue
+            blocked_for = time.monotonic() - next_wakeup
+            if blocked_for < self.stall_threshold:
+                continue
+            # Report each stall once
+            reported = next_wakeup
+            self.stalls += 1
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(no stack available)\n"
+            print(f"!!!! Event loop blocked for more than {blocked_for:.3f}s, loop thread stack:\n{stack}", end="")
+
+# Opt-in sampling profiler for the event loop thread. Samples the loop
+# thread's stack every PROFILE_SAMPLE_INTERVAL seconds and periodically writes
+# the aggregated stacks in the collapsed "frame;frame;frame count" format.
+class SamplingProfiler:
+    def __init__(self, output_path: str, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.output_path = output_path
+        self.interval = interval
+        self.counts = {} # {collapsed stack: samples}
+        self.thread = None
+        self.loop_thread_id = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.loop_thread_id = threading.get_ident()
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+        print(f"Sampling profiler enabled, writing to {self.output_path}.")
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is not None:
+                stack = self._collapse(frame)
+                self.counts[stack] = self.counts.get(stack, 0) + 1
+            if time.monotonic() - last_flush >= PROFILE_FLUSH_INTERVAL:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def flush(self):
+        tmp_path = self.output_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                for stack, count in list(self.counts.items()):
+                    f.write(f"{stack} {count}\n")
+            os.replace(tmp_path, self.output_path)
+        except OSError as e:
+            print(f"Could not write profile to {self.output_path}: {e}")
+
+loop_monitor = EventLoopMonitor()
+profiler = SamplingProfiler(PROFILE_OUTPUT) if PROFILE_OUTPUT else None
+
+# Voice events of the same member within this window are merged into one net transition
+VOICE_EVENT_COALESCE_WINDOW = 3.0 # seconds
+
+# Collapses rapid join/leave flapping per (guild, member). The first event of a
+# member opens a window; when it closes, the state before the first event is
+# compared with the state after the last one and only that net transition is
+# handled. Members are independent, so simultaneous joins are all processed.
+class VoiceEventCoalescer:
+    def __init__(self, handler, window: float = VOICE_EVENT_COALESCE_WINDOW):
+        self.handler = handler
+        self.window = window
+        self.pending = {} # {(guild_id, member_id): [member, first before, last after]}
+
+    def submit(self, member, before, after):
+        key = (member.guild.id, member.id)
+        if key in self.pending:
+            self.pending[key][0] = member
+            self.pending[key][2] = after
+            return
+        self.pending[key] = [member, before, after]
+        bot.loop.create_task(self._flush_later(key))
 
-# Cooldown for voice events
-COOLDOWN_AMOUNT = 10.0  # seconds
-last_executed_voice_event = time.time()
-def assert_voice_event_cooldown():
-    global last_executed_voice_event
-    if last_executed_voice_event + COOLDOWN_AMOUNT < time.time():
-        last_executed_voice_event = time.time()
+    async def _flush_later(self, key):
+        await asyncio.sleep(self.window)
+        member, before, after = self.pending.pop(key)
+        try:
+            await self.handler(member, before, after)
+        except Exception as e:
+            print(f"Error handling voice state update for {member.name}: {e}")
+
+# Who is in voice, per guild, maintained from voice state events as they arrive
+# (and rebuilt from the member cache on READY), so nobody has to poll
+# member.voice. Bots are not tracked.
+class VoicePresenceIndex:
+    def __init__(self):
+        self.guilds = defaultdict(set) # {guild_id: {member_id in a voice channel}}
+
+    def update(self, member, before, after):
+        # Returns True if the member joined voice, False if they left, None otherwise (move, mute, ...)
+        members = self.guilds[member.guild.id]
+        was_in_voice = member.id in members
+        if after.channel is not None:
+            members.add(member.id)
+        else:
+            members.discard(member.id)
+        if was_in_voice == (after.channel is not None):
+            return None
+        return not was_in_voice
+
+    def rebuild(self, guild):
+        members = self.guilds[guild.id]
+        members.clear()
+        for channel in guild.voice_channels + guild.stage_channels:
+            members.update(member.id for member in channel.members if not member.bot)
+
+    def in_any_guild(self, member_id: int) -> bool:
+        # Whether the member is in a voice channel of any guild (a member can
+        # share several guilds with the bot)
+        return any(member_id in members for members in self.guilds.values())
+
+voice_presence = VoicePresenceIndex()
+
+class CircuitOpenError(Exception):
+    """Raised when a host's circuit breaker is open and requests are short-circuited."""
+    pass
+
+# Async token bucket. The refill rate adapts: it is halved whenever the remote
+# side throttles us (429) and slowly recovers towards max_rate on success.
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1.0, min_rate: float = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 8
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        # The lock makes waiters queue up in order instead of racing for the same token
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        # Non-blocking variant: take a token if one is available right now
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return False
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def block_for(self, seconds: float):
+        # Honour Retry-After: nobody gets a token before the deadline
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def on_throttled(self):
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False # A half-open trial request is running
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self.trial_in_flight:
+            return False
+        # Half-open: let exactly one trial through until it succeeds or fails
+        self.trial_in_flight = True
         return True
-    return False
 
-# Steam API Class
-class SteamAPI:
-    def __init__(self, api_key):
-        self.api_key = api_key
+    def release_trial(self):
+        # The trial ended without a verdict (e.g. it was cancelled); allow another one
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == "half-open" or self.failures >= self.failure_threshold:
+            # (Re-)open the circuit; a failed half-open trial restarts the timeout
+            self.opened_at = time.monotonic()
+
+# Shared outbound HTTP client: one aiohttp session, plus a rate limiter and a
+# circuit breaker per host. All API calls in this file go through get_json().
+class HttpClient:
+    def __init__(self):
         self.session = None
-        self.last_api_call_time = 0
+        self.limiters = {}
+        self.breakers = {}
 
     async def initialize_session(self):
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
-            print("Aiohttp ClientSession initialized for SteamAPI.")
-
-    async def get_player_summary(self, steam_id):
-        # Wait for the global cooldown between calls
-        time_since_last_call = time.time() - self.last_api_call_time
-        if time_since_last_call < STEAM_API_COOLDOWN_BETWEEN_CALLS:
-            wait_time = STEAM_API_COOLDOWN_BETWEEN_CALLS - time_since_last_call
-            print(f"Waiting {wait_time:.2f}s due to global Steam API cooldown.")
-            await asyncio.sleep(wait_time)
-        
-        self.last_api_call_time = time.time()
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=HTTP_REQUEST_TIMEOUT))
+            print("Aiohttp ClientSession initialized.")
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            print("Aiohttp ClientSession closed.")
+
+    def configure_host(self, host: str, rate: float, capacity: float = 1.0):
+        # rate is in requests per second
+        self.limiters[host] = TokenBucket(rate, capacity)
+
+    def _limiter_for(self, host: str) -> TokenBucket:
+        if host not in self.limiters:
+            self.configure_host(host, rate=1.0, capacity=5)
+        return self.limiters[host]
+
+    def _breaker_for(self, host: str) -> CircuitBreaker:
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker()
+        return self.breakers[host]
+
+    @staticmethod
+    def _backoff_delay(attempt: int, retry_after: str = None) -> float:
+        if retry_after:
+            try:
+                return min(HTTP_BACKOFF_MAX, max(0.0, float(retry_after)))
+            except ValueError:
+                pass # HTTP-date form is not used by the APIs we call, fall back to backoff
+        delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt))
+        # "Equal jitter": keep half of the delay, randomize the other half
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def get_json(self, url: str, **kwargs):
+        await self.initialize_session()
+        host = urlsplit(url).hostname
+        limiter = self._limiter_for(host)
+        breaker = self._breaker_for(host)
+
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            if not breaker.allow_request():
+                raise CircuitOpenError(f"Circuit for {host} is open, skipping request.")
+            retry_after = None
+            try:
+                await limiter.acquire()
+                async with self.session.get(url, **kwargs) as response:
+                    if response.status == 429:
+                        limiter.on_throttled()
+                    if response.status == 429 or response.status >= 500:
+                        retry_after = response.headers.get("Retry-After")
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+            except aiohttp.ClientResponseError as e:
+                if e.status != 429 and e.status < 500:
+                    breaker.release_trial()
+                    raise # Client errors will not get better by retrying
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            except BaseException:
+                # Cancelled or an unexpected error: neither a success nor a host failure
+                breaker.release_trial()
+                raise
+            else:
+                breaker.record_success()
+                limiter.on_success()
+                return data
+
+            breaker.record_failure()
+            if attempt == HTTP_MAX_RETRIES:
+                raise error
+            delay = self._backoff_delay(attempt, retry_after)
+            if retry_after:
+                limiter.block_for(delay)
+            reason = f"HTTP {error.status}" if isinstance(error, aiohttp.ClientResponseError) else repr(error)
+            print(f"Request to {host} failed ({reason}), retrying in {delay:.2f}s ({attempt + 1}/{HTTP_MAX_RETRIES}).")
+            await asyncio.sleep(delay)
+
+http_client = HttpClient()
+
+# Prefetched joke buffer for /witz. A background task keeps the queue full,
+# and every fetched joke also goes into a small TTL cache that /witz falls
+# back to when the buffer is empty and the API is slow or down.
+class JokeBuffer:
+    def __init__(self, http, url: str = JOKE_API_URL):
+        self.http = http
+        self.url = url
+        self.queue = asyncio.Queue(maxsize=JOKE_BUFFER_SIZE)
+        self.cache = {} # {joke text: fetched_at}
+        self.refill_needed = asyncio.Event()
+        self.refill_task = None
+
+    def start(self):
+        if self.refill_task is None or self.refill_task.done():
+            self.refill_task = bot.loop.create_task(self._refill_loop())
+
+    async def fetch_jokes(self) -> List[str]:
+        data = await self.http.get_json(self.url)
+        jokes = [entry["text"] for entry in data if entry.get("text")]
+        now = time.monotonic()
+        for joke in jokes:
+            self.cache.pop(joke, None)
+            self.cache[joke] = now
+        # Drop the oldest entries once the cache is full (dicts keep insertion order)
+        while len(self.cache) > JOKE_CACHE_SIZE:
+            del self.cache[next(iter(self.cache))]
+        return jokes
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                while not self.queue.full():
+                    for joke in await self.fetch_jokes():
+                        if self.queue.full():
+                            break
+                        self.queue.put_nowait(joke)
+            except Exception as e:
+                print(f"Error refilling joke buffer: {e}")
+                await asyncio.sleep(JOKE_REFILL_RETRY_DELAY)
+                continue
+            self.refill_needed.clear()
+            await self.refill_needed.wait()
+
+    def cached_joke(self):
+        now = time.monotonic()
+        for joke in [joke for joke, fetched_at in self.cache.items() if now - fetched_at > JOKE_CACHE_TTL]:
+            del self.cache[joke]
+        return random.choice(list(self.cache)) if self.cache else None
+
+    async def get_joke(self):
+        # Fast path: answer from memory
+        try:
+            joke = self.queue.get_nowait()
+            self.refill_needed.set()
+            return joke
+        except asyncio.QueueEmpty:
+            pass
+        self.refill_needed.set()
+
+        joke = self.cached_joke()
+        if joke:
+            return joke
+
+        # Nothing in memory yet (e.g. right after startup): try one bounded live fetch
+        try:
+            jokes = await asyncio.wait_for(self.fetch_jokes(), timeout=JOKE_LIVE_FETCH_TIMEOUT)
+        except Exception as e:
+            print(f"Error with joke API: {e}")
+            return None
+        return jokes[0] if jokes else None
+
+joke_buffer = JokeBuffer(http_client)
+
+# Per-channel outbound queue. Handlers enqueue and return immediately; a
+# dispatcher task per channel waits OUTBOUND_COALESCE_WINDOW seconds, then
+# merges everything queued (highest priority first) into as few messages
+# under DISCORD_MESSAGE_LIMIT as possible. When the queue is full, the lowest
+# priority message is dropped. Callers that need to know whether their message
+# went out (reminders) pass a future, which is resolved with True once it was
+# sent or False if it was dropped or the send failed.
+class ChannelDispatcher:
+    def __init__(self, channel):
+        self.channel = channel
+        self.heap = [] # [(priority, sequence, text, enqueued_at, delivery future or None)]
+        self.sequence = 0
+        self.task = None
+        # Metrics
+        self.sent_messages = 0
+        self.sent_batches = 0
+        self.dropped_messages = 0
+        self.last_send_latency = 0.0 # Seconds from enqueue to send for the oldest message of the last batch
+        self.total_send_latency = 0.0
+
+    def enqueue(self, text: str, priority: int = PRIORITY_NORMAL, delivery: asyncio.Future = None) -> bool:
+        item = (priority, self.sequence, text, time.monotonic(), delivery)
+        self.sequence += 1
+        if len(self.heap) >= OUTBOUND_QUEUE_SIZE:
+            worst = max(self.heap)
+            if worst <= item:
+                self.dropped_messages += 1
+                return False
+            self.heap.remove(worst)
+            heapq.heapify(self.heap)
+            self.dropped_messages += 1
+            self._report(worst, False)
+        heapq.heappush(self.heap, item)
+        if self.task is None or self.task.done():
+            self.task = bot.loop.create_task(self._run())
+        return True
+
+    @staticmethod
+    def _report(item, delivered: bool):
+        delivery = item[4]
+        if delivery is not None and not delivery.done():
+            delivery.set_result(delivered)
+
+    @staticmethod
+    def _pack(items):
+        # Join the items' texts with newlines into chunks that fit into one
+        # Discord message. Returns [(chunk, [items with text in that chunk])]
+        chunks = []
+        current = ""
+        members = []
+        for item in items:
+            text = item[2]
+            while len(text) > DISCORD_MESSAGE_LIMIT:
+                if current:
+                    chunks.append((current, members))
+                    current = ""
+                chunks.append((text[:DISCORD_MESSAGE_LIMIT], [item]))
+                text = text[DISCORD_MESSAGE_LIMIT:]
+            if not current:
+                current = text
+                members = [item]
+            elif len(current) + 1 + len(text) <= DISCORD_MESSAGE_LIMIT:
+                current += "\n" + text
+                members.append(item)
+            else:
+                chunks.append((current, members))
+                current = text
+                members = [item]
+        if current:
+            chunks.append((current, members))
+        return chunks
+
+    async def _run(self):
+        while self.heap:
+            await asyncio.sleep(OUTBOUND_COALESCE_WINDOW)
+            items = [heapq.heappop(self.heap) for _ in range(len(self.heap))]
+            oldest = min(item[3] for item in items)
+            chunks = self._pack(items)
+            failed = set() # Sequence numbers of items with a chunk that could not be sent
+            try:
+                while chunks:
+                    chunk, members = chunks[0]
+                    try:
+                        await self.channel.send(chunk)
+                    except discord.HTTPException as e:
+                        print(f"Error sending to channel {self.channel.id}: {e}")
+                        failed.update(item[1] for item in members)
+                    else:
+                        self.sent_batches += 1
+                    chunks.pop(0)
+            finally:
+                # Chunks still left were never sent (the task was cancelled or crashed)
+                for _, members in chunks:
+                    failed.update(item[1] for item in members)
+                for item in items:
+                    self._report(item, item[1] not in failed)
+            self.sent_messages += len(items)
+            self.last_send_latency = time.monotonic() - oldest
+            self.total_send_latency += self.last_send_latency * len(items)
+
+    def metrics(self):
+        return {
+            "queue_depth": len(self.heap),
+            "sent_messages": self.sent_messages,
+            "sent_batches": self.sent_batches,
+            "dropped_messages": self.dropped_messages,
+            "last_send_latency": self.last_send_latency,
+            "avg_send_latency": self.total_send_latency / self.sent_messages if self.sent_messages else 0.0,
+        }
+
+# {channel_id: ChannelDispatcher}
+channel_dispatchers = {}
+
+def send_to_channel(channel, text: str, priority: int = PRIORITY_NORMAL, delivery: asyncio.Future = None) -> bool:
+    if channel.id not in channel_dispatchers:
+        channel_dispatchers[channel.id] = ChannelDispatcher(channel)
+    return channel_dispatchers[channel.id].enqueue(text, priority, delivery)
+
+# Shared state: everything that has to exist once per deployment rather than once
+# per shard (Steam monitors, pending reminders, cluster-wide locks) goes through a
+# state store. MemoryStateStore serves a single process; RedisStateStore lets
+# several worker processes share the same state.
+class MemoryStateStore:
+    shared = False
+
+    def __init__(self, reminder_db_path: str = REMINDER_DB_PATH):
+        self.hashes = defaultdict(dict)
+        # Pending reminders live in SQLite, and only a (due_at, id) heap entry
+        # per reminder is kept in memory. The connection belongs to the
+        # executor's thread, so no SQLite work runs on the event loop.
+        self.reminder_db_path = reminder_db_path
+        self.db = None # Only used on the executor's thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reminder-store")
+        self.reminder_heap = [] # [(due_at, reminder_id)]
+        self.load_lock = asyncio.Lock()
+        self.loaded = False
+
+    async def hget(self, key: str, field):
+        return self.hashes[key].get(str(field))
+
+    async def hset(self, key: str, field, value):
+        self.hashes[key][str(field)] = value
+
+    async def hsetnx(self, key: str, field, value) -> bool:
+        # Sets the field only if it does not exist yet; returns whether it was set
+        fields = self.hashes[key]
+        if str(field) in fields:
+            return False
+        fields[str(field)] = value
+        return True
 
-        if not self.session or self.session.closed:
-            await self.initialize_session()
+    async def hdel(self, key: str, field) -> bool:
+        return self.hashes[key].pop(str(field), None) is not None
+
+    async def hgetall(self, key: str) -> dict:
+        return dict(self.hashes[key])
+
+    async def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        # A single process always holds every lock
+        return True
 
-        url = f"http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/?key={self.api_key}&steamids={steam_id}"
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _open(self):
+        if self.db is not None:
+            return self.db
+        import sqlite3
+        self.db = sqlite3.connect(self.reminder_db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS reminders ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "user_id INTEGER NOT NULL, "
+            "due_at REAL NOT NULL, "
+            "message TEXT NOT NULL)"
+        )
+        self.db.commit()
+        return self.db
+
+    def _read_heap(self):
+        heap = self._open().execute("SELECT due_at, id FROM reminders").fetchall()
+        heapq.heapify(heap)
+        return heap
+
+    async def _reminders(self):
+        # Open the store and rebuild the heap from all pending reminders on first use
+        async with self.load_lock:
+            if not self.loaded:
+                self.reminder_heap = await self._run(self._read_heap)
+                self.loaded = True
+                print(f"Loaded {len(self.reminder_heap)} pending reminders.")
+
+    def _insert(self, user_id: int, due_at: float, message: str) -> int:
+        db = self._open()
+        cursor = db.execute(
+            "INSERT INTO reminders (user_id, due_at, message) VALUES (?, ?, ?)",
+            (user_id, due_at, message),
+        )
+        db.commit()
+        return cursor.lastrowid
+
+    def _select(self, reminder_ids):
+        placeholders = ",".join("?" * len(reminder_ids))
+        return self._open().execute(
+            f"SELECT id, user_id, message FROM reminders WHERE id IN ({placeholders}) ORDER BY due_at",
+            reminder_ids,
+        ).fetchall()
+
+    def _delete(self, reminder_ids):
+        db = self._open()
+        db.executemany("DELETE FROM reminders WHERE id = ?", [(reminder_id,) for reminder_id in reminder_ids])
+        db.commit()
+
+    async def add_reminder(self, user_id: int, due_at: float, message: str) -> int:
+        await self._reminders()
+        reminder_id = await self._run(self._insert, user_id, due_at, message)
+        heapq.heappush(self.reminder_heap, (due_at, reminder_id))
+        return reminder_id
+
+    async def next_reminder_due(self):
+        await self._reminders()
+        return self.reminder_heap[0][0] if self.reminder_heap else None
+
+    async def claim_due_reminders(self, now: float, limit: int):
+        # Returns [(reminder_id, user_id, message)]; claimed reminders are not
+        # handed out again, but stay in SQLite until complete_reminders() (or
+        # come back with release_reminders() if they could not be delivered)
+        await self._reminders()
+        due_ids = []
+        while self.reminder_heap and self.reminder_heap[0][0] <= now and len(due_ids) < limit:
+            due_ids.append(heapq.heappop(self.reminder_heap)[1])
+        if not due_ids:
+            return []
+        return await self._run(self._select, due_ids)
+
+    async def complete_reminders(self, reminder_ids):
+        if reminder_ids:
+            await self._run(self._delete, list(reminder_ids))
+
+    async def release_reminders(self, reminder_ids, retry_at: float):
+        # Hands claimed reminders out again at retry_at. SQLite keeps the
+        # original due time, so after a restart they are due right away.
+        await self._reminders()
+        for reminder_id in reminder_ids:
+            heapq.heappush(self.reminder_heap, (retry_at, reminder_id))
+
+    async def count_reminders(self) -> int:
+        await self._reminders()
+        return len(self.reminder_heap)
+
+    async def close(self):
+        def close_db():
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+        await self._run(close_db)
+        self.executor.shutdown()
+
+# Renews a lock only if it is still held by the caller
+REDIS_RENEW_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Claims due reminders by moving their score to the end of the claim timeout,
+# atomically, so each reminder is claimed by one worker. If that worker dies
+# before complete_reminders(), the reminder becomes due again afterwards.
+REDIS_CLAIM_REMINDERS_SCRIPT = """
+local due = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+for _, id in ipairs(due) do
+    redis.call('zadd', KEYS[1], ARGV[2], id)
+end
+return due
+"""
+
+class RedisStateStore:
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "dcbot:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            print("="*50)
+            print("ERROR: STATE_STORE_URL is set, but the 'redis' package is not installed.")
+            print("Please run: pip install redis")
+            print("="*50)
+            sys.exit(1)
+        self.redis = redis_asyncio.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    async def hget(self, key: str, field):
+        return await self.redis.hget(self.prefix + key, str(field))
+
+    async def hset(self, key: str, field, value):
+        await self.redis.hset(self.prefix + key, str(field), value)
+
+    async def hsetnx(self, key: str, field, value) -> bool:
+        return bool(await self.redis.hsetnx(self.prefix + key, str(field), value))
+
+    async def hdel(self, key: str, field) -> bool:
+        return bool(await self.redis.hdel(self.prefix + key, str(field)))
+
+    async def hgetall(self, key: str) -> dict:
+        return await self.redis.hgetall(self.prefix + key)
+
+    async def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        key = f"{self.prefix}lock:{name}"
+        if await self.redis.set(key, owner, nx=True, ex=int(ttl)):
+            return True
+        return bool(await self.redis.eval(REDIS_RENEW_LOCK_SCRIPT, 1, key, owner, int(ttl)))
+
+    # Reminders: a sorted set of ids scored by due time plus a hash with the payloads
+    async def add_reminder(self, user_id: int, due_at: float, message: str) -> int:
+        reminder_id = await self.redis.incr(self.prefix + "reminders:next_id")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.prefix + "reminders:data", reminder_id, json.dumps([user_id, message]))
+            pipe.zadd(self.prefix + "reminders:due", {reminder_id: due_at})
+            await pipe.execute()
+        return reminder_id
+
+    async def next_reminder_due(self):
+        entries = await self.redis.zrange(self.prefix + "reminders:due", 0, 0, withscores=True)
+        return entries[0][1] if entries else None
+
+    async def claim_due_reminders(self, now: float, limit: int):
+        claimed = await self.redis.eval(
+            REDIS_CLAIM_REMINDERS_SCRIPT, 1, self.prefix + "reminders:due", now, now + REMINDER_CLAIM_TIMEOUT, limit,
+        )
+        if not claimed:
+            return []
+        payloads = await self.redis.hmget(self.prefix + "reminders:data", claimed)
+        rows = []
+        for reminder_id, payload in zip(claimed, payloads):
+            if payload is not None:
+                user_id, message = json.loads(payload)
+                rows.append((int(reminder_id), user_id, message))
+        return rows
+
+    async def complete_reminders(self, reminder_ids):
+        if reminder_ids:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.zrem(self.prefix + "reminders:due", *reminder_ids)
+                pipe.hdel(self.prefix + "reminders:data", *reminder_ids)
+                await pipe.execute()
+
+    async def release_reminders(self, reminder_ids, retry_at: float):
+        if reminder_ids:
+            await self.redis.zadd(self.prefix + "reminders:due", {reminder_id: retry_at for reminder_id in reminder_ids})
+
+    async def count_reminders(self) -> int:
+        return await self.redis.zcard(self.prefix + "reminders:due")
+
+def create_state_store():
+    if STATE_STORE_URL:
+        return RedisStateStore(STATE_STORE_URL)
+    if SHARD_IDS:
+        print("Warning: running as a cluster worker without STATE_STORE_URL; Steam monitors and reminders are not shared.")
+    return MemoryStateStore()
+
+state_store = create_state_store()
+
+# Reminder scheduler: a single dispatcher task sleeps until the earliest reminder
+# in the state store is due and delivers everything that is due in one batch.
+# In cluster mode only the worker holding the "reminders" lock delivers.
+class ReminderScheduler:
+    def __init__(self, store):
+        self.store = store
+        self.wakeup = asyncio.Event()
+        self.dispatcher_task = None
+
+    def start(self):
+        if self.dispatcher_task is None or self.dispatcher_task.done():
+            self.dispatcher_task = bot.loop.create_task(self._dispatch_loop())
+
+    async def schedule(self, user_id: int, due_at: float, message: str) -> int:
+        reminder_id = await self.store.add_reminder(user_id, due_at, message)
+        # Only wake the dispatcher if the new reminder is now the earliest one
+        if await self.store.next_reminder_due() == due_at:
+            self.wakeup.set()
+        return reminder_id
+
+    async def _wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch_loop(self):
+        await bot.wait_until_ready()
+        # Reminders scheduled on other workers don't set our wakeup event
+        max_wait = REMINDER_POLL_INTERVAL if self.store.shared else None
+        while True:
+            self.wakeup.clear()
+            if not await self.store.acquire_lock("reminders", WORKER_ID, LEADER_LOCK_TTL):
+                await self._wait(LEADER_LOCK_TTL / 2)
+                continue
+            next_due = await self.store.next_reminder_due()
+            if next_due is None:
+                await self._wait(max_wait)
+                continue
+            delay = next_due - time.time()
+            if delay > 0:
+                await self._wait(min(delay, max_wait) if max_wait else delay)
+                continue
+
+            batch = await self.store.claim_due_reminders(time.time(), REMINDER_BATCH_SIZE)
+            # Delivered together, so the whole batch shares one coalesced send.
+            # Only reminders that actually went out are removed from the store.
+            results = await asyncio.gather(*(self._deliver(*row) for row in batch))
+            await self.store.complete_reminders([row[0] for row, delivered in zip(batch, results) if delivered])
+            failed = [row[0] for row, delivered in zip(batch, results) if not delivered]
+            if failed:
+                print(f"Could not deliver {len(failed)} reminders, retrying in {REMINDER_RETRY_DELAY}s.")
+                await self.store.release_reminders(failed, time.time() + REMINDER_RETRY_DELAY)
+
+    @staticmethod
+    async def _deliver(reminder_id: int, user_id: int, message: str) -> bool:
         try:
-            async with self.session.get(url) as response:
-                response.raise_for_status()
-                return await response.json()
+            return await deliver_reminder(user_id, message)
+        except Exception as e:
+            print(f"Error delivering reminder {reminder_id}: {e}")
+            return False
+
+reminder_scheduler = ReminderScheduler(state_store)
+
+def get_main_channel():
+    # --- NEW: Load Channel ID from config.py ---
+    channel_chat = bot.get_channel(config.MAIN_CHANNEL_ID)
+    # In cluster mode the main guild may belong to another worker's shards;
+    # sending only needs the channel id
+    if channel_chat is None and state_store.shared:
+        channel_chat = bot.get_partial_messageable(config.MAIN_CHANNEL_ID)
+    return channel_chat
+
+# Returns False if the reminder could not be sent and should be tried again later
+async def deliver_reminder(user_id: int, message: str) -> bool:
+    channel_chat = get_main_channel()
+    if channel_chat:
+        delivery = asyncio.get_running_loop().create_future()
+        queued = send_to_channel(
+            channel_chat, f"<@{user_id}>, you wanted to be reminded of: **{message}**, Nyan~", PRIORITY_REMINDER, delivery
+        )
+        return queued and await delivery
+    try:
+        user = bot.get_user(user_id) or await bot.fetch_user(user_id)
+        await user.send(f"Your reminder: **{message}**, Nyan~ (I couldn't find the channel, so here's a DM.)")
+    except (discord.Forbidden, discord.NotFound):
+        # Retrying won't help
+        print(f"Could not send reminder to user {user_id} (channel not found and DMs closed).")
+    except discord.HTTPException as e:
+        print(f"Could not send reminder to user {user_id}: {e}")
+        return False
+    return True
+
+# Plays a pre-decoded PCM buffer in 20 ms frames without spawning FFmpeg
+class PCMBufferSource(discord.AudioSource):
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        self.position = 0
+
+    def read(self) -> bytes:
+        frame_size = discord.opus.Encoder.FRAME_SIZE
+        frame = self.buffer[self.position:self.position + frame_size]
+        self.position += frame_size
+        if len(frame) == 0:
+            return b""
+        if len(frame) < frame_size:
+            # Pad the last frame with silence
+            return bytes(frame) + b"\x00" * (frame_size - len(frame))
+        return bytes(frame)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        self.buffer.release()
+
+# Mixes several PCM sources into the one stream a voice connection can play.
+# read() runs in the voice thread every 20 ms: it takes one frame from each
+# voice and sums them sample by sample. If the sum would clip, the whole frame
+# is turned down instead (instant attack, slow release), so overlapping sounds
+# get quieter rather than distorted. Volume normalization already happened
+# when the sounds were decoded into the PCM cache.
+class MixerSource(discord.AudioSource):
+    def __init__(self, max_voices: int = MIXER_MAX_VOICES):
+        self.max_voices = max_voices
+        self.voices = [] # [(name, AudioSource)], oldest first
+        self.retired = [] # Voices to clean up from the voice thread
+        self.finished = False # Set once read() returned b"" and the player stopped
+        self.limiter = 1.0
+        self.lock = threading.Lock()
+
+    def add(self, source, name: str) -> bool:
+        # Returns False if the mixer already ran dry; the caller needs a new one then
+        with self.lock:
+            if self.finished:
+                return False
+            self.voices.append((name, source))
+            if len(self.voices) > self.max_voices:
+                # Cut off the oldest sounds. read() may be using them right now,
+                # so they are cleaned up there.
+                self.retired += self.voices[:-self.max_voices]
+                del self.voices[:-self.max_voices]
+            return True
+
+    def playing(self) -> List[str]:
+        with self.lock:
+            return [name for name, _ in self.voices]
+
+    def read(self) -> bytes:
+        with self.lock:
+            voices = list(self.voices)
+            retired, self.retired = self.retired, []
+        for _, source in retired:
+            source.cleanup()
+
+        frames = []
+        done = []
+        for voice in voices:
+            frame = voice[1].read()
+            if frame:
+                frames.append(frame)
+            else:
+                done.append(voice)
+        with self.lock:
+            for voice in done:
+                if voice in self.voices:
+                    self.voices.remove(voice)
+            if not frames and not self.voices:
+                self.finished = True
+        for _, source in done:
+            source.cleanup()
+
+        if not frames:
+            # A sound may have been added while we were reading
+            return b"" if self.finished else b"\x00" * discord.opus.Encoder.FRAME_SIZE
+        if len(frames) == 1 and self.limiter == 1.0:
+            return frames[0]
+        return self._mix(frames)
+
+    def _mix(self, frames) -> bytes:
+        mixed = list(map(sum, zip(*[array.array("h", frame) for frame in frames])))
+        peak = max(max(mixed), -min(mixed))
+        self.limiter = min(32767 / peak if peak > 32767 else 1.0, self.limiter + MIXER_LIMITER_RELEASE)
+        if self.limiter < 1.0:
+            mixed = map(int, map(self.limiter.__mul__, mixed))
+        return array.array("h", mixed).tobytes()
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        with self.lock:
+            voices = self.voices + self.retired
+            self.voices, self.retired = [], []
+            self.finished = True
+        for _, source in voices:
+            source.cleanup()
+
+# Transcodes each sound file once to 48 kHz stereo s16le PCM on disk and keeps
+# the memory-mapped results in a size-bounded LRU. Entries are keyed by path
+# and invalidated when the file's mtime or size changes.
+class PCMSoundCache:
+    def __init__(self, cache_dir: str = SOUND_CACHE_DIR, max_bytes: int = SOUND_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # {sound path: (signature, mmap or bytes)}
+        self.total_bytes = 0
+        self.locks = {} # {sound path: asyncio.Lock}, so a file is only transcoded once at a time
+
+    @staticmethod
+    def _signature(path: str):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _pcm_path(self, path: str, signature) -> str:
+        key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+        # "-norm": files from before volume normalization are decoded again
+        return os.path.join(self.cache_dir, f"{key}-{signature[0]}-{signature[1]}-norm.pcm")
+
+    def invalidate(self, path: str):
+        self._drop(path)
+
+    def _drop(self, path: str):
+        entry = self.entries.pop(path, None)
+        if entry:
+            # The mmap itself is closed once the last AudioSource using it is gone
+            self.total_bytes -= len(entry[1])
+
+    @staticmethod
+    def _copy_wav(path: str, tmp_path: str) -> bool:
+        # Fast path: WAV files already in Discord's format only need their header stripped
+        import wave
+        try:
+            with wave.open(path, "rb") as wav:
+                if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) != (48000, 2, 2):
+                    return False
+                with open(tmp_path, "wb") as out:
+                    out.write(wav.readframes(wav.getnframes()))
+                return True
+        except (wave.Error, EOFError):
+            return False # Not a plain PCM WAV, let FFmpeg handle it
+
+    @staticmethod
+    def _normalize(pcm_path: str, chunk_bytes: int = SOUND_NORMALIZE_CHUNK_BYTES):
+        # Scale the decoded sound towards SOUND_TARGET_RMS so all sounds play at a
+        # similar volume, without letting its peak clip. Runs once per sound, when
+        # it is decoded, so playback and mixing never have to apply a gain.
+        # Runs in a worker thread, but the C loops over a chunk never release the
+        # GIL, so chunks stay small enough not to stall the event loop.
+        squares = samples_seen = peak = 0
+        with open(pcm_path, "rb") as f:
+            while chunk := f.read(chunk_bytes):
+                samples = array.array("h", chunk[:len(chunk) // 2 * 2])
+                if samples:
+                    squares += sum(sample * sample for sample in samples)
+                    samples_seen += len(samples)
+                    peak = max(peak, max(samples), -min(samples))
+        if not squares:
+            return # Empty or silent
+        gain = min(SOUND_TARGET_RMS / math.sqrt(squares / samples_seen), SOUND_MAX_GAIN, 32767 / peak)
+        if abs(gain - 1.0) < 0.05:
+            return
+        with open(pcm_path, "r+b") as f:
+            offset = 0
+            while chunk := f.read(chunk_bytes):
+                samples = array.array("h", chunk[:len(chunk) // 2 * 2])
+                f.seek(offset)
+                f.write(array.array("h", map(int, map(gain.__mul__, samples))).tobytes())
+                offset += len(chunk)
+                f.seek(offset)
+
+    async def _transcode(self, path: str, pcm_path: str):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = pcm_path + ".tmp"
+
+        # File I/O runs in a worker thread so warming many sounds doesn't block the loop
+        if await asyncio.to_thread(self._copy_wav, path, tmp_path):
+            await asyncio.to_thread(self._normalize, tmp_path)
+            os.replace(tmp_path, pcm_path)
+            return
+
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", path,
+            "-f", "s16le", "-ar", "48000", "-ac", "2", tmp_path,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise RuntimeError(f"FFmpeg failed for {path}: {stderr.decode(errors='replace').strip()}")
+        await asyncio.to_thread(self._normalize, tmp_path)
+        os.replace(tmp_path, pcm_path)
+
+    def _remove_stale(self, pcm_path: str):
+        # Remove decoded files of older versions of the same sound
+        prefix = os.path.basename(pcm_path).split("-", 1)[0] + "-"
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith(prefix) and os.path.join(self.cache_dir, filename) != pcm_path:
+                os.remove(os.path.join(self.cache_dir, filename))
+
+    async def get(self, path: str):
+        signature = self._signature(path)
+        entry = self.entries.get(path)
+        if entry and entry[0] == signature:
+            self.entries.move_to_end(path)
+            return entry[1]
+
+        lock = self.locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            entry = self.entries.get(path)
+            if entry and entry[0] == signature:
+                return entry[1]
+            self._drop(path)
+
+            pcm_path = self._pcm_path(path, signature)
+            if not os.path.exists(pcm_path):
+                print(f"Decoding sound '{path}' into the PCM cache.")
+                await self._transcode(path, pcm_path)
+                self._remove_stale(pcm_path)
+
+            import mmap
+            with open(pcm_path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+            self.entries[path] = (signature, data)
+            self.total_bytes += len(data)
+            # Evict least recently used sounds, but never the one we just loaded
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                self._drop(next(iter(self.entries)))
+            return data
+
+    async def warm(self, paths):
+        for path in paths:
+            try:
+                await self.get(path)
+            except Exception as e:
+                print(f"Could not pre-decode sound '{path}': {e}")
+
+sound_cache = PCMSoundCache()
+
+class SoundEntry:
+    __slots__ = ("name", "path", "size", "mtime_ns", "duration")
+
+    def __init__(self, name: str, path: str, size: int, mtime_ns: int, duration: float = None):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.duration = duration # Seconds, only known for WAV files
+
+# Catalogue of all soundboard sounds. Names are indexed by every lowercase
+# 1-, 2- and 3-gram, so autocomplete only has to intersect a few small sets
+# instead of scanning every name. A background watcher rescans SOUNDS_DIR and
+# applies only the differences.
+class SoundCatalogue:
+    def __init__(self, directory: str = SOUNDS_DIR):
+        self.directory = directory
+        self.sounds = {} # {name: SoundEntry}
+        self.ngrams = defaultdict(set) # {lowercase n-gram: {name}}
+        self.sorted_names = [] # Sorted case-insensitively, used for short queries
+        self.watch_task = None
+
+    @staticmethod
+    def _ngrams(text: str):
+        text = text.lower()
+        return {text[i:i + n] for n in (1, 2, 3) for i in range(len(text) - n + 1)}
+
+    def _read_directory(self, known):
+        # Runs in a worker thread: list the directory and read metadata of new/changed files
+        listing = {}
+        if not os.path.isdir(self.directory):
+            return listing
+        with os.scandir(self.directory) as it:
+            files = sorted(
+                (entry for entry in it if entry.is_file() and entry.name.lower().endswith(SOUND_EXTENSIONS)),
+                key=lambda entry: SOUND_EXTENSIONS.index(os.path.splitext(entry.name)[1].lower()),
+            )
+            for entry in files:
+                name = os.path.splitext(entry.name)[0]
+                if name in listing:
+                    continue # .wav wins over .mp3
+                stat = entry.stat()
+                old = known.get(name)
+                if old and old.path == entry.path and (old.mtime_ns, old.size) == (stat.st_mtime_ns, stat.st_size):
+                    listing[name] = old
+                    continue
+                duration = None
+                if entry.name.lower().endswith(".wav"):
+                    import wave
+                    try:
+                        with wave.open(entry.path, "rb") as wav:
+                            duration = wav.getnframes() / wav.getframerate()
+                    except (wave.Error, EOFError):
+                        pass
+                listing[name] = SoundEntry(name, entry.path, stat.st_size, stat.st_mtime_ns, duration)
+        return listing
+
+    def _apply(self, listing):
+        # Returns (added, removed, changed) names
+        added = [name for name in listing if name not in self.sounds]
+        removed = [name for name in self.sounds if name not in listing]
+        changed = [name for name in listing if name in self.sounds and listing[name] is not self.sounds[name]]
+
+        for name in removed:
+            for gram in self._ngrams(name):
+                self.ngrams[gram].discard(name)
+                if not self.ngrams[gram]:
+                    del self.ngrams[gram]
+        for name in added:
+            for gram in self._ngrams(name):
+                self.ngrams[gram].add(name)
+        for name in removed + changed:
+            sound_cache.invalidate(self.sounds[name].path)
+
+        self.sounds = listing
+        if added or removed:
+            self.sorted_names = sorted(listing, key=str.lower)
+        return added, removed, changed
+
+    async def refresh(self):
+        listing = await asyncio.to_thread(self._read_directory, dict(self.sounds))
+        added, removed, changed = self._apply(listing)
+        if added or removed or changed:
+            print(f"Sound catalogue updated: {len(added)} added, {len(removed)} removed, {len(changed)} changed ({len(self.sounds)} total).")
+            # Decode new and changed sounds into the PCM cache in the background
+            bot.loop.create_task(sound_cache.warm([self.sounds[name].path for name in added + changed]))
+        return added, removed, changed
+
+    def start(self):
+        if self.watch_task is None or self.watch_task.done():
+            self.watch_task = bot.loop.create_task(self._watch())
+
+    async def _watch(self):
+        # The initial scan is done by load_sounds()
+        while True:
+            await asyncio.sleep(SOUND_RESCAN_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error rescanning sound directory '{self.directory}': {e}")
+
+    def resolve(self, name: str):
+        return self.sounds.get(name)
+
+    def search(self, query: str, limit: int = 25) -> List[str]:
+        query = query.lower()
+        if not query:
+            return self.sorted_names[:limit]
+
+        if len(query) <= 3:
+            candidates = self.ngrams.get(query, set())
+        else:
+            # Intersect the trigram sets, smallest first, then verify the substring
+            postings = sorted((self.ngrams.get(query[i:i + 3], set()) for i in range(len(query) - 2)), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates &= posting
+                if not candidates:
+                    break
+            candidates = {name for name in candidates if query in name.lower()}
+
+        if len(candidates) > 4 * limit:
+            # Many matches: walking the sorted list stops early and avoids sorting them all
+            results = []
+            for name in self.sorted_names:
+                if name in candidates:
+                    results.append(name)
+                    if len(results) == limit:
+                        break
+            return results
+        return sorted(candidates, key=str.lower)[:limit]
+
+sound_catalogue = SoundCatalogue()
+
+# All message triggers compiled into one case-insensitive regex, so every
+# message is scanned once no matter how many triggers are configured. The
+# first trigger (in config order) that matches and is not on cooldown wins.
+class MessageTriggers:
+    def __init__(self, triggers):
+        self.triggers = []
+        alternatives = []
+        for index, trigger in enumerate(triggers):
+            patterns = [re.escape(keyword) for keyword in trigger.get("keywords", [])]
+            if trigger.get("regex"):
+                patterns.append(trigger["regex"])
+            if not patterns:
+                print(f"Warning: message trigger {index} has neither keywords nor regex, ignoring it.")
+                continue
+            self.triggers.append({
+                "reply": trigger["reply"],
+                "cooldown": trigger.get("cooldown", 0),
+                "channels": set(trigger.get("channels") or ()),
+                "last_fired": {}, # {channel_id: time.monotonic()}
+            })
+            alternatives.append(f"(?P<_trigger{len(self.triggers) - 1}>{'|'.join(patterns)})")
+        self.pattern = re.compile("|".join(alternatives), re.IGNORECASE) if alternatives else None
+        self.channel_limits = {} # {channel_id: TokenBucket}
+
+    def match(self, content: str, channel_id: int):
+        # Returns the reply to send, or None
+        if self.pattern is None:
+            return None
+        matched = {int(m.lastgroup[len("_trigger"):]) for m in self.pattern.finditer(content)}
+        now = time.monotonic()
+        for index in sorted(matched):
+            trigger = self.triggers[index]
+            if trigger["channels"] and channel_id not in trigger["channels"]:
+                continue
+            last_fired = trigger["last_fired"].get(channel_id)
+            if last_fired is not None and now - last_fired < trigger["cooldown"]:
+                continue
+            # Per-channel rate limit across all triggers, so busy channels don't get flooded
+            limiter = self.channel_limits.get(channel_id)
+            if limiter is None:
+                limiter = self.channel_limits[channel_id] = TokenBucket(TRIGGER_CHANNEL_RATE / TRIGGER_CHANNEL_PER, capacity=TRIGGER_CHANNEL_RATE)
+            if not limiter.try_acquire():
+                return None
+            trigger["last_fired"][channel_id] = now
+            return trigger["reply"]
+        return None
+
+message_triggers = MessageTriggers(getattr(config, "MESSAGE_TRIGGERS", DEFAULT_MESSAGE_TRIGGERS))
+
+# Greeting/farewell schedule compiled once at startup into a sorted table of
+# second-of-day boundaries. Each event is a single bisect lookup. Windows are
+# checked in config order where they overlap; an entry without start/end is
+# the default for all remaining times. A window whose end is before its start
+# (e.g. 20:00-05:30) runs across midnight.
+class VoiceGreetingSchedule:
+    def __init__(self, entries):
+        windows = []
+        default = None
+        for entry in entries:
+            if "start" not in entry:
+                default = default or entry
+                continue
+            # End times are inclusive (to the second), like the old HH:MM:SS comparisons
+            start, end = self._seconds(entry["start"]), self._seconds(entry["end"]) + 1
+            if start < end:
+                windows.append((start, end, entry))
+            else:
+                # Split at midnight into start-24:00 and 00:00-end
+                windows.append((start, 24 * 60 * 60, entry))
+                windows.append((0, end, entry))
+
+        self.boundaries = sorted({0} | {start for start, _, _ in windows} | {end for _, end, _ in windows if end < 24 * 60 * 60})
+        self.replies = []
+        for point in self.boundaries:
+            reply = next((entry for start, end, entry in windows if start <= point < end), default)
+            self.replies.append(reply)
+
+    @staticmethod
+    def _seconds(value: str) -> int:
+        parts = [int(part) for part in value.split(":")]
+        hours, minutes, seconds = (parts + [0, 0])[:3]
+        return hours * 3600 + minutes * 60 + seconds
+
+    def lookup(self, now: datetime):
+        # Returns the matching entry ({"text": ..., "gifs": [...]}) or None
+        second_of_day = now.hour * 3600 + now.minute * 60 + now.second
+        return self.replies[bisect.bisect_right(self.boundaries, second_of_day) - 1]
+
+    def render(self, now: datetime, member_id: int):
+        # Text and GIF go out as one message
+        entry = self.lookup(now)
+        if entry is None:
+            return None
+        message = f"{entry['text']} <@{member_id}>"
+        if entry.get("gifs"):
+            message += f"\n{random.choice(entry['gifs'])}"
+        return message
+
+voice_join_schedule = VoiceGreetingSchedule(getattr(config, "VOICE_JOIN_MESSAGES", [
+    {"start": "07:00", "end": "11:30", "text": "Mion!", "gifs": config.GREETING_MORNING_GIFS},
+    {"text": "Hamlo!", "gifs": config.GREETING_DAY_GIFS},
+]))
+voice_leave_schedule = VoiceGreetingSchedule(getattr(config, "VOICE_LEAVE_MESSAGES", [
+    {"start": "20:00", "end": "23:59", "text": "GuNa!", "gifs": config.FAREWELL_NIGHT_GIFS},
+    {"start": "00:01", "end": "05:30", "text": "GuNa!", "gifs": config.FAREWELL_NIGHT_GIFS},
+    {"text": "cu!", "gifs": config.FAREWELL_DAY_GIFS},
+]))
+
+# Remembers which games were announced for each member, so presence updates
+# that only change other activity fields (Spotify tracks, rich presence state)
+# don't re-announce a game that is still running. Keyed per game, so a member
+# with two announced games running at once doesn't alternate between them.
+class PresenceAnnouncements:
+    def __init__(self, ttl: float = PRESENCE_ANNOUNCE_TTL):
+        self.ttl = ttl
+        self.announced = {} # {(member_id, game name): announced_at}
+
+    def should_announce(self, member_id: int, game_name: str) -> bool:
+        now = time.monotonic()
+        key = (member_id, game_name)
+        announced_at = self.announced.get(key)
+        if announced_at is not None and now - announced_at < self.ttl:
+            return False
+        self.announced[key] = now
+        if len(self.announced) > PRESENCE_PRUNE_THRESHOLD:
+            self.prune(now)
+        return True
+
+    def prune(self, now: float):
+        expired = [key for key, announced_at in self.announced.items() if now - announced_at >= self.ttl]
+        for key in expired:
+            del self.announced[key]
+
+presence_announcements = PresenceAnnouncements()
+
+class GameReaction:
+    __slots__ = ("name", "steam_reply", "presence_reply", "gifs")
+
+    def __init__(self, name: str, steam_reply: str = None, presence_reply: str = None, gifs=None):
+        self.name = name
+        self.steam_reply = steam_reply
+        self.presence_reply = presence_reply
+        self.gifs = list(gifs or [])
+
+# Normalizes a game name for lookups: case-folded, without trademark signs and
+# punctuation. With strip_version, trailing version numbers are removed too,
+# so "EA SPORTS™ FIFA 23" and "EA SPORTS FIFA 26" share a key.
+@functools.lru_cache(maxsize=4096)
+def normalize_game_name(name: str, strip_version: bool = False) -> str:
+    tokens = re.sub(r"[^\w]+", " ", name.casefold().replace("™", "").replace("®", "").replace("©", "")).split()
+    if strip_version:
+        while len(tokens) > 1 and tokens[-1].isdigit():
+            tokens.pop()
+    return " ".join(tokens)
+
+# All game reactions (Steam announcement text, presence joke, GIFs) in one
+# place, indexed by normalized name and alias. Lookups try the exact
+# normalized name first and then, for names ending in a version number, the
+# version-agnostic one.
+class GameReactionRegistry:
+    def __init__(self):
+        self.exact = {} # {normalized name: GameReaction}
+        self.versionless = {} # {normalized name without version: GameReaction}
+        self.config_mtime = None
+        self.reload_task = None
+
+    def load(self, reactions):
+        exact = {}
+        versionless = {}
+        for name, settings in reactions.items():
+            reaction = GameReaction(
+                name,
+                steam_reply=settings.get("steam_reply"),
+                presence_reply=settings.get("presence_reply"),
+                gifs=settings.get("gifs"),
+            )
+            for key in [name] + list(settings.get("aliases", [])):
+                exact.setdefault(normalize_game_name(key), reaction)
+                versionless.setdefault(normalize_game_name(key, strip_version=True), reaction)
+        self.exact = exact
+        self.versionless = versionless
+        print(f"Loaded {len(reactions)} game reactions.")
+
+    def lookup(self, game_name: str):
+        key = normalize_game_name(game_name)
+        reaction = self.exact.get(key)
+        if reaction is None:
+            # Only a name that carries a version matches other versions, so
+            # "Counter-Strike" or "Portal" don't pick up the sequel's reaction
+            versionless_key = normalize_game_name(game_name, strip_version=True)
+            if versionless_key != key:
+                reaction = self.versionless.get(versionless_key)
+        return reaction
+
+    def load_from_config(self):
+        self.load(game_reactions_from_config())
+        self.config_mtime = os.path.getmtime(config.__file__)
+
+    def start(self):
+        if self.reload_task is None or self.reload_task.done():
+            self.reload_task = bot.loop.create_task(self._watch_config())
+
+    async def _watch_config(self):
+        # Hot reload: re-import config.py when it changes and rebuild the index
+        while True:
+            await asyncio.sleep(GAME_REACTIONS_RELOAD_INTERVAL)
+            try:
+                mtime = os.path.getmtime(config.__file__)
+            except OSError:
+                continue
+            if mtime == self.config_mtime:
+                continue
+            self.config_mtime = mtime
+            try:
+                importlib.reload(config)
+                self.load(game_reactions_from_config())
+            except Exception as e:
+                print(f"Error reloading game reactions from config.py, keeping the old ones: {e}")
+
+def game_reactions_from_config():
+    if hasattr(config, "GAME_REACTIONS"):
+        return config.GAME_REACTIONS
+
+    # Older config.py files: build the reactions from the separate tables
+    reactions = {}
+    for name, reply in config.GAME_STEAM_REPLIES.items():
+        reactions.setdefault(name, {})["steam_reply"] = reply
+    for name, reply in config.PRESENCE_JOKES.items():
+        reactions.setdefault(name, {})["presence_reply"] = reply
+    for name, gif_list in (("Halo Infinite", "HALO_GIFS"), ("EA SPORTS™ FIFA 23", "FIFA_GIFS"),
+                           ("Rocket League", "ROCKET_LEAGUE_GIFS"), ("Counter-Strike 2", "COUNTER_STRIKE_GIFS")):
+        if hasattr(config, gif_list):
+            reactions.setdefault(name, {})["gifs"] = getattr(config, gif_list)
+    return reactions
+
+game_reactions = GameReactionRegistry()
+game_reactions.load_from_config()
+
+# Steam game history: every game change the poller sees is appended to a
+# compact event log (integers only, game names are stored once in a
+# dictionary table). Finished sessions are added to per-member-and-day,
+# per-game-and-day and all-time playtime rollups, so /stats and /topgames
+# never touch the raw events.
+# Writes are buffered and flushed in one transaction every
+# GAME_HISTORY_FLUSH_INTERVAL seconds (or once GAME_HISTORY_BATCH_SIZE
+# events are waiting).
+GAME_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS game_events (
+    ts INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    game_id INTEGER); -- NULL = stopped playing
+CREATE INDEX IF NOT EXISTS game_events_ts ON game_events (ts);
+CREATE TABLE IF NOT EXISTS playtime_daily (
+    member_id INTEGER NOT NULL,
+    day INTEGER NOT NULL, -- Days since the epoch (UTC)
+    game_id INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    sessions INTEGER NOT NULL,
+    PRIMARY KEY (member_id, day, game_id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS game_daily (
+    day INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    sessions INTEGER NOT NULL,
+    PRIMARY KEY (day, game_id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS playtime_total (
+    member_id INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    sessions INTEGER NOT NULL,
+    last_day INTEGER NOT NULL,
+    PRIMARY KEY (member_id, game_id)) WITHOUT ROWID;
+"""
+
+# All SQLite work (writes, compaction, the /stats queries) runs on a dedicated
+# worker thread, one call at a time, so it never blocks the event loop and
+# doesn't queue up behind sound decoding in the default executor. Pending
+# changes are keyed by game name and the queries resolve names in SQL, so a
+# worker that doesn't run the poller also sees games another worker added.
+class GameHistory:
+    def __init__(self, db_path: str = GAME_HISTORY_DB_PATH):
+        self.db_path = db_path
+        self.db = None # Only used on the executor's thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="game-history")
+        self.game_ids = {} # {name: id}, only used on the executor's thread
+        self.open_sessions = {} # {member_id: (game name, started_at)}
+        self.pending_events = [] # [(ts, member_id, game name)]
+        self.pending_daily = defaultdict(lambda: [0.0, 0]) # {(member_id, day, game name): [seconds, sessions]}
+        self.pending_total = defaultdict(lambda: [0.0, 0, 0]) # {(member_id, game name): [seconds, sessions, last_day]}
+        self.flush_lock = asyncio.Lock() # One batch at a time, and readers wait for the one in progress
+        self.flush_task = None
+        self.batch_flush_task = None
+        self.last_compaction = 0.0
+
+    def _open(self):
+        if self.db is not None:
+            return self.db
+        import sqlite3
+        self.db = sqlite3.connect(self.db_path)
+        # Only takes effect on a new database, before the first table is created
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(GAME_HISTORY_SCHEMA)
+        self.db.commit()
+        return self.db
+
+    def _resolve_game_ids(self, db, names):
+        # Game ids for the names, adding new games. Other workers may have
+        # added a game since we last looked, so unknown names are looked up too.
+        unknown = [name for name in names if name not in self.game_ids]
+        if unknown:
+            db.executemany("INSERT INTO games (name) VALUES (?) ON CONFLICT (name) DO NOTHING", [(name,) for name in unknown])
+            for start in range(0, len(unknown), 500):
+                chunk = unknown[start:start + 500]
+                self.game_ids.update(db.execute(
+                    f"SELECT name, id FROM games WHERE name IN ({','.join('?' * len(chunk))})", chunk,
+                ))
+        return self.game_ids
+
+    def observe(self, member_id: int, game, now: float = None) -> bool:
+        # Record what a member is playing (None = nothing). Returns whether this was a change.
+        now = time.time() if now is None else now
+        game = game or None
+        current = self.open_sessions.get(member_id)
+        if (current[0] if current else None) == game:
+            return False
+        if current:
+            self._add_playtime(member_id, current[0], current[1], now)
+        if game is None:
+            del self.open_sessions[member_id]
+        else:
+            self.open_sessions[member_id] = (game, now)
+        self.pending_events.append((int(now), member_id, game))
+        if len(self.pending_events) >= GAME_HISTORY_BATCH_SIZE and (self.batch_flush_task is None or self.batch_flush_task.done()):
+            self.batch_flush_task = bot.loop.create_task(self.flush())
+        return True
+
+    def close_missing(self, member_ids, now: float = None):
+        # End the sessions of members who are no longer being watched
+        for member_id in [member_id for member_id in self.open_sessions if member_id not in member_ids]:
+            self.observe(member_id, None, now)
+
+    def _add_playtime(self, member_id: int, game: str, started_at: float, ended_at: float):
+        # Split the session at UTC midnight so every day gets its share; the
+        # session itself is counted on the day it started
+        total = self.pending_total[(member_id, game)]
+        total[0] += ended_at - started_at
+        total[1] += 1
+        total[2] = int(ended_at // 86400)
+        sessions = 1
+        while started_at < ended_at:
+            day = int(started_at // 86400)
+            day_end = min(ended_at, (day + 1) * 86400)
+            rollup = self.pending_daily[(member_id, day, game)]
+            rollup[0] += day_end - started_at
+            rollup[1] += sessions
+            sessions = 0
+            started_at = day_end
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not (self.pending_events or self.pending_daily or self.pending_total):
+                return
+            # Hand the batch to the worker thread; new changes collect in fresh buffers meanwhile
+            batch = (self.pending_events, self.pending_daily, self.pending_total)
+            self.pending_events = []
+            self.pending_daily = defaultdict(self.pending_daily.default_factory)
+            self.pending_total = defaultdict(self.pending_total.default_factory)
+            try:
+                await self._run(self._write, *batch)
+            except Exception:
+                # Keep the batch for the next flush
+                events, daily, total = batch
+                self.pending_events[:0] = events
+                for key, (seconds, sessions) in daily.items():
+                    self.pending_daily[key][0] += seconds
+                    self.pending_daily[key][1] += sessions
+                for key, (seconds, sessions, last_day) in total.items():
+                    pending = self.pending_total[key]
+                    pending[0] += seconds
+                    pending[1] += sessions
+                    pending[2] = max(pending[2], last_day)
+                raise
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _write(self, events, daily, total):
+        db = self._open()
+        try:
+            self._write_batch(db, events, daily, total)
+        except Exception:
+            # Games added in this batch were rolled back with it
+            self.game_ids.clear()
+            raise
+
+    def _write_batch(self, db, events, daily, total):
+        with db:
+            names = {game for _, _, game in events if game} | {key[-1] for key in daily} | {key[-1] for key in total}
+            game_ids = self._resolve_game_ids(db, names)
+            game_daily = defaultdict(lambda: [0, 0])
+            for (member_id, day, game), (seconds, sessions) in daily.items():
+                game_daily[(day, game_ids[game])][0] += round(seconds)
+                game_daily[(day, game_ids[game])][1] += sessions
+            db.executemany(
+                "INSERT INTO game_events (ts, member_id, game_id) VALUES (?, ?, ?)",
+                [(ts, member_id, game_ids[game] if game else None) for ts, member_id, game in events],
+            )
+            db.executemany(
+                "INSERT INTO playtime_daily (member_id, day, game_id, seconds, sessions) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (member_id, day, game_id) DO UPDATE SET "
+                "seconds = seconds + excluded.seconds, sessions = sessions + excluded.sessions",
+                [(member_id, day, game_ids[game], round(seconds), sessions)
+                 for (member_id, day, game), (seconds, sessions) in daily.items()],
+            )
+            db.executemany(
+                "INSERT INTO game_daily (day, game_id, seconds, sessions) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (day, game_id) DO UPDATE SET "
+                "seconds = seconds + excluded.seconds, sessions = sessions + excluded.sessions",
+                [(*key, seconds, sessions) for key, (seconds, sessions) in game_daily.items()],
+            )
+            db.executemany(
+                "INSERT INTO playtime_total (member_id, game_id, seconds, sessions, last_day) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (member_id, game_id) DO UPDATE SET "
+                "seconds = seconds + excluded.seconds, sessions = sessions + excluded.sessions, "
+                "last_day = MAX(last_day, excluded.last_day)",
+                [(member_id, game_ids[game], round(seconds), sessions, last_day)
+                 for (member_id, game), (seconds, sessions, last_day) in total.items()],
+            )
+
+    async def compact(self, now: float = None):
+        # Apply the retention settings and give the freed pages back to the file system
+        now = time.time() if now is None else now
+        await self.flush()
+        events, rollups = await self._run(self._compact, now)
+        self.last_compaction = now
+        if events or rollups:
+            print(f"Game history compacted: {events} events and {rollups} daily rollups removed.")
+
+    def _compact(self, now: float):
+        db = self._open()
+        with db:
+            events = rollups = 0
+            if GAME_HISTORY_RETENTION_DAYS:
+                events = db.execute("DELETE FROM game_events WHERE ts < ?",
+                                    (int(now) - GAME_HISTORY_RETENTION_DAYS * 86400,)).rowcount
+            if GAME_HISTORY_ROLLUP_RETENTION_DAYS:
+                cutoff = int(now // 86400) - GAME_HISTORY_ROLLUP_RETENTION_DAYS
+                rollups = db.execute("DELETE FROM playtime_daily WHERE day < ?", (cutoff,)).rowcount
+                rollups += db.execute("DELETE FROM game_daily WHERE day < ?", (cutoff,)).rowcount
+        db.execute("PRAGMA incremental_vacuum")
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return events, rollups
+
+    def start(self):
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = bot.loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(GAME_HISTORY_FLUSH_INTERVAL)
+            try:
+                # The database file is shared by the whole cluster, so only the
+                # worker running the Steam poller compacts it
+                may_compact = not state_store.shared or steam_api_instance.is_poller
+                if may_compact and time.time() - self.last_compaction >= GAME_HISTORY_COMPACT_INTERVAL:
+                    await self.compact()
+                else:
+                    await self.flush()
+            except Exception as e:
+                print(f"Error writing game history: {e}")
+
+    async def close(self):
+        # Sessions still open at shutdown end now
+        self.close_missing(set())
+        await self.flush()
+
+    async def _query(self, sql: str, params):
+        await self.flush()
+        def run():
+            return self._open().execute(sql, params).fetchall()
+        return await self._run(run)
+
+    async def member_stats(self, member_id: int, days: int = None, limit: int = 10):
+        # [(game, seconds, sessions)], most played first
+        if days:
+            return await self._query(
+                "SELECT games.name, top.total, top.sessions FROM ("
+                "SELECT game_id, SUM(seconds) AS total, SUM(sessions) AS sessions FROM playtime_daily "
+                "WHERE member_id = ? AND day > ? GROUP BY game_id ORDER BY total DESC LIMIT ?"
+                ") AS top JOIN games ON games.id = top.game_id ORDER BY top.total DESC",
+                (member_id, int(time.time() // 86400) - days, limit),
+            )
+        return await self._query(
+            "SELECT games.name, top.seconds, top.sessions FROM ("
+            "SELECT game_id, seconds, sessions FROM playtime_total "
+            "WHERE member_id = ? ORDER BY seconds DESC LIMIT ?"
+            ") AS top JOIN games ON games.id = top.game_id ORDER BY top.seconds DESC",
+            (member_id, limit),
+        )
+
+    async def top_games(self, days: int, limit: int = 10):
+        # [(game, seconds, players)] over the last `days` days, most played first.
+        # Everyone who played a game within the period has their last session in it.
+        cutoff = int(time.time() // 86400) - days
+        return await self._query(
+            "SELECT games.name, top.total, IFNULL(players.count, 0) FROM ("
+            "SELECT game_id, SUM(seconds) AS total FROM game_daily "
+            "WHERE day > ? GROUP BY game_id ORDER BY total DESC LIMIT ?"
+            ") AS top JOIN games ON games.id = top.game_id LEFT JOIN ("
+            "SELECT game_id, COUNT(*) AS count FROM playtime_total WHERE last_day > ? GROUP BY game_id"
+            ") AS players ON players.game_id = top.game_id ORDER BY top.total DESC",
+            (cutoff, limit, cutoff),
+        )
+
+    def current_session(self, member_id: int):
+        # (game, seconds so far) if the member is playing right now
+        current = self.open_sessions.get(member_id)
+        if current is None:
+            return None
+        return current[0], time.time() - current[1]
+
+game_history = GameHistory()
+
+def format_playtime(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    return f"{minutes // 60}h {minutes % 60:02d}m"
+
+# Steam API Class
+class SteamAPI:
+    def __init__(self, api_key, http, store):
+        self.api_key = api_key
+        self.http = http
+        self.store = store
+        self.poller_task = None
+        self.wakeup = asyncio.Event()
+        self.is_poller = False # Whether this worker held the "steam-poller" lock on its last check
+        # Metrics
+        self.poll_cycles = 0
+        self.failed_requests = 0
+        self.announcements = 0
+        # Stay inside Steam's quota: one call per cooldown window
+        self.http.configure_host(STEAM_API_HOST, rate=1 / STEAM_API_COOLDOWN_BETWEEN_CALLS)
+
+    async def get_player_summaries(self, steam_ids):
+        # GetPlayerSummaries accepts a comma-separated list of up to 100 Steam IDs
+        ids_param = ",".join(str(steam_id) for steam_id in steam_ids)
+        url = f"http://{STEAM_API_HOST}/ISteamUser/GetPlayerSummaries/v0002/?key={self.api_key}&steamids={ids_param}"
+        try:
+            return await self.http.get_json(url)
+        except CircuitOpenError as e:
+            print(f"Skipping Steam API request: {e}")
+            return None
         except aiohttp.ClientResponseError as e:
             print(f"Error during Steam API request (HTTP {e.status}): {e.message}")
             return None
@@ -117,103 +2060,185 @@ class SteamAPI:
             print(f"Unexpected error during Steam API request: {e}")
             return None
 
-    async def monitor_single_steam_user(self, member_id: int, channel_chat_id: int):
-        member = bot.get_user(member_id)
-        if member is None:
-            print(f"Monitor for unknown user {member_id} stopped.")
-            return
+    def start(self):
+        if self.poller_task is None or self.poller_task.done():
+            self.poller_task = bot.loop.create_task(self.poll_steam_presences(config.MAIN_CHANNEL_ID))
 
-        # Load Steam ID from config.py
-        steam_id = config.STEAM_IDS.get(member.id)
-        if not steam_id:
-            print(f"No Steam ID found for Discord user {member.name}. Monitor stopped.")
+    async def _wait(self, timeout: float):
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
             return
-
+        # Woken by a join: let others joining at the same time share the request
+        await asyncio.sleep(STEAM_API_JOIN_POLL_DELAY)
+
+    async def sync_voice(self):
+        # After a full (re)connect, once voice_presence has been rebuilt for every
+        # guild: start monitors for everyone in voice, in case they joined while we
+        # were disconnected. Monitors are per user, not per guild, so a monitor is
+        # only stopped for a member who is in no guild's voice channel. With a
+        # shared store the other workers' guilds are unknown here, so nothing is
+        # stopped; their leave events do that.
+        for member_id in config.STEAM_IDS:
+            if voice_presence.in_any_guild(member_id):
+                await self.start_monitor(member_id)
+        if not self.store.shared:
+            for member_id in await self.store.hgetall(STEAM_MONITORS_KEY):
+                if not voice_presence.in_any_guild(int(member_id)):
+                    await self.stop_monitor(int(member_id))
+
+    async def start_monitor(self, member_id: int):
+        # Register the user and make sure the central poller is running. The poller
+        # is woken up so it sees the new user now rather than one interval later.
+        if await self.store.hsetnx(STEAM_MONITORS_KEY, member_id, "leer"):
+            print(f"User {member_id} added to Steam poller.")
+            self.wakeup.set()
+        self.start()
+
+    async def stop_monitor(self, member_id: int):
+        if await self.store.hdel(STEAM_MONITORS_KEY, member_id):
+            print(f"Steam monitor for user {member_id} removed.")
+        # We can't see what they play any more, so their session ends here
+        game_history.observe(int(member_id), None)
+
+    async def poll_steam_presences(self, channel_chat_id: int):
+        # One poller for all users: every cycle fetches all active Steam IDs in batched calls.
+        # With a shared state store every worker runs this loop, but only the one
+        # holding the "steam-poller" lock actually polls.
+        await bot.wait_until_ready()
         channel_chat = bot.get_channel(channel_chat_id)
+        if channel_chat is None and self.store.shared:
+            channel_chat = bot.get_partial_messageable(channel_chat_id)
         if not channel_chat:
             print("Error: Chat channel for Steam notifications not found.")
             return
 
-        game_name = "leer"
-        print(f"Starting Steam monitor for {member.name} ({steam_id}).")
-
+        print("Starting central Steam presence poller.")
         while True:
-            # Check if the user is still in the voice channel
-            current_member = channel_chat.guild.get_member(member_id)
-            if current_member is None or not current_member.voice or not current_member.voice.channel:
-                print(f"User {member.name} is no longer in a voice channel. Stopping Steam monitor.")
-                break
-
-            data = await self.get_player_summary(steam_id)
-            if data and 'gameextrainfo' in data["response"]["players"][0]:
-                current_game = data["response"]["players"][0]["gameextrainfo"]
-                if current_game != "leer" and current_game != game_name:
-                    game_name = current_game
-                    
-                    # --- NEW: Dynamic replies from config.py ---
-                    message = f"Have fun playing {game_name} " # Default message
-                    gif = None
-
-                    # Check for a custom reply message in config
-                    if game_name in config.GAME_STEAM_REPLIES:
-                        message = config.GAME_STEAM_REPLIES[game_name]
-                    
-                    # --- NEW: Check for game-specific GIFs from config.py ---
-                    if game_name == "Halo Infinite":
-                         gif = random.choice(config.HALO_GIFS)
-                    elif game_name == "EA SPORTS™ FIFA 23":
-                         gif = random.choice(config.FIFA_GIFS)
-                    elif game_name == "Rocket League":
-                         gif = random.choice(config.ROCKET_LEAGUE_GIFS)
-                    elif game_name == "Counter-Strike 2":
-                         gif = random.choice(config.COUNTER_STRIKE_GIFS)
-                    # Add more 'elif' blocks here for other games
-                    # --- End of dynamic replies ---
-
-                    await channel_chat.send(f"{message}<@{member.id}>")
-                    if gif:
-                        await channel_chat.send(gif)
-            
-            # Wait for the poll interval
-            await asyncio.sleep(STEAM_API_POLL_INTERVAL)
-
-        if member_id in active_steam_monitors:
-            del active_steam_monitors[member_id]
-            print(f"Monitor task for {member.name} removed.")
-
-steam_api_instance = SteamAPI(STEAM_API_KEY)
+            self.is_poller = await self.store.acquire_lock("steam-poller", WORKER_ID, STEAM_API_POLL_INTERVAL + LEADER_LOCK_TTL)
+            if not self.is_poller:
+                await asyncio.sleep(LEADER_LOCK_TTL)
+                continue
+
+            # Exactly the users in voice: on_voice_state_update adds and removes them
+            # (on every worker) as the gateway reports joins and leaves
+            self.wakeup.clear()
+            monitors = await self.store.hgetall(STEAM_MONITORS_KEY)
+
+            # Users who left on another worker's shards
+            game_history.close_missing({int(member_id) for member_id in monitors})
+
+            # Map Steam IDs (as returned by the API, i.e. strings) back to Discord users
+            steam_to_member = {}
+            for member_id in monitors:
+                steam_id = config.STEAM_IDS.get(int(member_id))
+                if steam_id:
+                    steam_to_member[str(steam_id)] = member_id
+            if not steam_to_member:
+                if not self.store.shared:
+                    break
+                # Stay the poller; users may join on any worker
+                await self._wait(STEAM_API_POLL_INTERVAL)
+                continue
+
+            steam_ids = list(steam_to_member)
+            for start in range(0, len(steam_ids), STEAM_API_MAX_IDS_PER_CALL):
+                if start:
+                    # Renew the lock between batches, so a slow cycle cannot outlive it
+                    # while another worker takes over and announces the same games
+                    self.is_poller = await self.store.acquire_lock("steam-poller", WORKER_ID, STEAM_API_POLL_INTERVAL + LEADER_LOCK_TTL)
+                    if not self.is_poller:
+                        print("Lost the steam-poller lock during a poll cycle.")
+                        break
+                data = await self.get_player_summaries(steam_ids[start:start + STEAM_API_MAX_IDS_PER_CALL])
+                if not data:
+                    self.failed_requests += 1
+                    continue
+                for player in data.get("response", {}).get("players", []):
+                    member_id = steam_to_member.get(player.get("steamid"))
+                    if member_id is None:
+                        continue
+                    # The user may have left while we were waiting for the API
+                    last_game = await self.store.hget(STEAM_MONITORS_KEY, member_id)
+                    if last_game is None:
+                        continue
+                    current_game = player.get("gameextrainfo")
+                    game_history.observe(int(member_id), current_game)
+                    if current_game and current_game != "leer" and current_game != last_game:
+                        await self.store.hset(STEAM_MONITORS_KEY, member_id, current_game)
+                        self.announcements += 1
+                        await self.announce_game(channel_chat, int(member_id), current_game)
+            if not self.is_poller:
+                continue
+
+            self.poll_cycles += 1
+            # Wait for the poll interval, or until someone new joins voice on this worker
+            await self._wait(STEAM_API_POLL_INTERVAL)
+
+        print("No users left to monitor. Steam presence poller stopped.")
+
+    async def announce_game(self, channel_chat, member_id: int, game_name: str):
+        # --- NEW: Reply and GIF from the game reaction registry (config.py) ---
+        message = f"Have fun playing {game_name} " # Default message
+        gif = None
+        reaction = game_reactions.lookup(game_name)
+        if reaction:
+            if reaction.steam_reply:
+                message = reaction.steam_reply
+            if reaction.gifs:
+                gif = random.choice(reaction.gifs)
+
+        message = f"{message}<@{member_id}>"
+        if gif:
+            message += f"\n{gif}"
+        send_to_channel(channel_chat, message)
+
+steam_api_instance = SteamAPI(STEAM_API_KEY, http_client, state_store)
 
 @bot.event
+@timed("event")
 async def on_disconnect():
-    if hasattr(steam_api_instance, 'session') and steam_api_instance.session is not None:
-        if not steam_api_instance.session.closed:
-            try:
-                await steam_api_instance.session.close()
-                print("Aiohttp ClientSession closed.")
-            except Exception as e:
-                print(f"Error closing Aiohttp ClientSession: {e}")
+    # Subsystems keep running across reconnects; they are shut down in shutdown()
     print("Bot has disconnected.")
 
+async def load_sounds():
+    # Runs in the background after login, so indexing and PCM warm-up never delay
+    # the gateway connection. /playsound finds sounds as soon as the scan is done.
+    if not os.path.exists(SOUNDS_DIR):
+        os.makedirs(SOUNDS_DIR)
+        print(f"Directory '{SOUNDS_DIR}' was created. Please place your sound files here.")
+    started = time.monotonic()
+    try:
+        await sound_catalogue.refresh()
+        print(f"Loaded soundboard sounds in {time.monotonic() - started:.2f}s: {', '.join(sound_catalogue.sorted_names)}")
+    except Exception as e:
+        print(f"Error scanning sound directory '{SOUNDS_DIR}': {e}")
+    # Keep watching the directory for changes
+    sound_catalogue.start()
+
+startup_ready_seconds = None # Process start to first READY
+ready_events = 0
+
 @bot.event
+@timed("event")
 async def on_ready():
-    print(f"We have logged in as {bot.user.name}")
-    await bot.change_presence(status=discord.Status.online, activity=activity)
-
-    # Initialize the SteamAPI session
-    await steam_api_instance.initialize_session()
-    
-    # Load the list of available sounds
-    global SOUNDS_LIST
-    SOUNDS_LIST.clear()
-    if os.path.exists(SOUNDS_DIR):
-        for filename in os.listdir(SOUNDS_DIR):
-            if filename.endswith(('.mp3', '.wav')):
-                SOUNDS_LIST.append(os.path.splitext(filename)[0])
-        print(f"Loaded soundboard sounds: {', '.join(SOUNDS_LIST)}")
+    # Fires again after every reconnect/resume failure; everything is already
+    # running by then (see setup_hook), so apart from resyncing the voice index
+    # this only reports
+    global startup_ready_seconds, ready_events
+    ready_events += 1
+    # The member cache was just rebuilt; resync the voice index with it
+    for guild in bot.guilds:
+        voice_presence.rebuild(guild)
+    await steam_api_instance.sync_voice()
+    if startup_ready_seconds is None:
+        startup_ready_seconds = time.monotonic() - STARTUP_STARTED
+        print(f"We have logged in as {bot.user.name} (ready {startup_ready_seconds:.2f}s after start)")
     else:
-        print(f"Warning: Sound directory '{SOUNDS_DIR}' not found.")
+        print(f"Ready again after a reconnect ({ready_events - 1} so far).")
 
 @bot.event
+@timed("event")
 async def on_command_error(ctx, error):
     # (Legacy error handler for prefix commands, can be removed if not used)
     if isinstance(error, commands.CommandOnCooldown):
@@ -222,6 +2247,7 @@ async def on_command_error(ctx, error):
         raise error
 
 @bot.tree.error
+@timed("event", "app_command_error")
 async def on_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
     # Global error handler for slash commands
     if isinstance(error, app_commands.CommandOnCooldown):
@@ -230,89 +2256,150 @@ async def on_error(interaction: discord.Interaction, error: app_commands.AppComm
         print(f"Unhandled app command error: {error} in interaction {interaction}")
         await interaction.response.send_message("An unexpected error occurred.", ephemeral=True)
 
-async def play_sound_in_vc(interaction: discord.Interaction, sound_name: str):
-    global voice_operation_in_progress
+# One voice session per guild. All sounds are mixed into a single stream, so
+# several /playsound requests play at the same time (up to MIXER_MAX_VOICES)
+# over one connection, and the bot only disconnects after
+# VOICE_IDLE_DISCONNECT seconds without anything to play. Guilds are
+# independent of each other.
+class VoiceSession:
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        self.vc = None
+        self.mixer = None # MixerSource while something is playing
+        self.connect_lock = asyncio.Lock()
+        self.idle_task = None
+
+    async def _connect(self, channel):
+        self.vc = self.guild.voice_client
+        if self.vc and self.vc.is_connected():
+            if self.vc.channel.id != channel.id:
+                await self.vc.move_to(channel)
+            return
 
+        self.vc = await channel.connect()
+        # Short pause to allow Discord to update mute status
+        await asyncio.sleep(0.5)
+        bot_member = self.guild.me
+        if bot_member.voice and bot_member.voice.mute:
+            print("!!!! DIAGNOSIS: Bot is SERVER-MUTED (mute=True) !!!!")
+        if bot_member.voice and bot_member.voice.self_mute:
+            print("!!!! DIAGNOSIS: Bot is SELF-MUTED (self_mute=True) !!!!")
+
+    async def _load(self, sound_path: str):
+        # Play the sound from the PCM cache, falling back to FFmpeg if decoding failed
+        try:
+            return PCMBufferSource(await sound_cache.get(sound_path))
+        except Exception as e:
+            print(f"PCM cache unavailable for '{sound_path}', using FFmpeg: {e}")
+            return discord.FFmpegPCMAudio(sound_path)
+
+    async def play(self, channel, sound_path: str, sound_name: str) -> int:
+        # Returns how many sounds are playing now, including this one
+        if self.idle_task:
+            self.idle_task.cancel()
+            self.idle_task = None
+        source = await self._load(sound_path)
+        try:
+            async with self.connect_lock:
+                await self._connect(channel)
+        except Exception:
+            source.cleanup()
+            raise
+
+        if self.mixer is None or not self.mixer.add(source, sound_name):
+            mixer = MixerSource()
+            mixer.add(source, sound_name)
+            if self.vc.is_playing():
+                self.vc.stop() # The previous mixer ran dry but its player hasn't noticed yet
+
+            # The after callback runs in the voice thread, so hand completion back to the loop
+            loop = asyncio.get_running_loop()
+            def after(error):
+                if error:
+                    print(f'Player error: {error}')
+                loop.call_soon_threadsafe(self._finished, mixer)
+
+            # Only a mixer that is actually playing becomes the session's mixer;
+            # if play() fails (Opus not loaded, disconnected), the next sound starts a new one
+            self.mixer = None
+            try:
+                self.vc.play(mixer, after=after)
+            except Exception:
+                mixer.cleanup()
+                self.idle_task = bot.loop.create_task(self._disconnect_when_idle())
+                raise
+            self.mixer = mixer
+        return len(self.mixer.playing())
+
+    def _finished(self, mixer: MixerSource):
+        if mixer is self.mixer:
+            self.mixer = None
+            self.idle_task = bot.loop.create_task(self._disconnect_when_idle())
+
+    async def _disconnect_when_idle(self):
+        await asyncio.sleep(VOICE_IDLE_DISCONNECT)
+        self.idle_task = None
+        async with self.connect_lock:
+            if self.mixer is None and self.vc and self.vc.is_connected():
+                channel_name = self.vc.channel.name
+                await self.vc.disconnect()
+                print(f"Bot left voice channel {channel_name} (after soundboard).")
+
+def get_voice_session(guild: discord.Guild) -> VoiceSession:
+    if guild.id not in voice_sessions:
+        voice_sessions[guild.id] = VoiceSession(guild)
+    return voice_sessions[guild.id]
+
+async def play_sound_in_vc(interaction: discord.Interaction, sound_name: str):
     if not interaction.user.voice or not interaction.user.voice.channel:
         await interaction.followup.send("You must be in a voice channel to use this!", ephemeral=True)
         return
 
-    # Check for both .wav and .mp3
-    sound_path_wav = os.path.join(SOUNDS_DIR, f"{sound_name}.wav")
-    sound_path_mp3 = os.path.join(SOUNDS_DIR, f"{sound_name}.mp3")
-    
-    selected_sound_path = None
-    if os.path.exists(sound_path_wav):
-        selected_sound_path = sound_path_wav
-    elif os.path.exists(sound_path_mp3):
-        selected_sound_path = sound_path_mp3
-    else:
+    sound = sound_catalogue.resolve(sound_name)
+    if sound is None:
         await interaction.followup.send(f"The sound '{sound_name}' was not found.", ephemeral=True)
         return
+    selected_sound_path = sound.path
 
-    if voice_operation_in_progress:
-        await interaction.followup.send("I'm already playing a sound or joining a channel. Please try again shortly.", ephemeral=True)
-        return
-    
-    voice_operation_in_progress = True
-    vc = interaction.guild.voice_client
-
+    channel = interaction.user.voice.channel
+    session = get_voice_session(interaction.guild)
     try:
-        if vc: # If bot is already in a VC
-            if vc.channel.id != interaction.user.voice.channel.id:
-                await interaction.followup.send(f"Switching to {interaction.user.voice.channel.name}...", ephemeral=True)
-                await vc.move_to(interaction.user.voice.channel)
-            else:
-                if vc.is_playing():
-                     await interaction.followup.send("I'm already playing a sound. Wait until it's finished.", ephemeral=True)
-                     return
-        else: # If bot is not in a VC
-            try:
-                vc = await interaction.user.voice.channel.connect()
-            except Exception as e:
-                await interaction.followup.send(f"An unexpected error occurred while joining: {e}", ephemeral=True)
-                return
-
-        if not vc:
-            await interaction.followup.send("Could not establish a valid voice connection.", ephemeral=True)
-            return
-        
-        # Short pause to allow Discord to update mute status
-        await asyncio.sleep(0.5) 
-        bot_member = interaction.guild.me
-        if bot_member.voice and bot_member.voice.mute:
-            print("!!!! DIAGNOSIS: Bot is SERVER-MUTED (mute=True) !!!!")
-        if bot_member.voice and bot_member.voice.self_mute:
-            print("!!!! DIAGNOSIS: Bot is SELF-MUTED (self_mute=True) !!!!")
-
-        # Play the sound
-        source = discord.FFmpegPCMAudio(selected_sound_path)
-        vc.play(source, after=lambda e: print(f'Player error: {e}') if e else None)
-        await interaction.followup.send(f"Playing sound: **{sound_name}** in **{interaction.user.voice.channel.name}**", ephemeral=False)
-
-        # Wait until playing is finished
-        while vc.is_playing():
-            await asyncio.sleep(0.5)
-            
+        playing = await session.play(channel, selected_sound_path, sound_name)
     except Exception as e:
-        print(f"Error while playing sound: {e}")
-        await interaction.followup.send(f"An error occurred while playing the sound: {e}", ephemeral=True)
-    finally:
-        voice_operation_in_progress = False
-        # Disconnect after playing
-        if vc and vc.is_connected():
-            await vc.disconnect()
-            print(f"Bot left voice channel {interaction.user.voice.channel.name} (after soundboard).")
+        print(f"Error while playing sound '{sound_name}' in guild {interaction.guild.id}: {e}")
+        await interaction.followup.send("Could not play the sound right now. Please try again shortly.", ephemeral=True)
+        return
+
+    if playing > 1:
+        await interaction.followup.send(f"Playing sound: **{sound_name}** in **{channel.name}** (together with {playing - 1} more)", ephemeral=False)
+    else:
+        await interaction.followup.send(f"Playing sound: **{sound_name}** in **{channel.name}**", ephemeral=False)
 
 @bot.event
+@timed("event")
 async def on_presence_update(before, after):
     # --- NEW: Generalized function ---
-    # Ignore bots and users not in voice
-    if after.bot or not after.voice or not after.voice.channel:
+    # Cheap checks first: this is the most frequent event with presences enabled
+    if after.bot:
+        return
+
+    # Only game activities that have a presence reply in config are interesting
+    replies = {}
+    for activity in after.activities:
+        if isinstance(activity, discord.Game):
+            reaction = game_reactions.lookup(activity.name)
+            if reaction and reaction.presence_reply:
+                replies[activity.name] = reaction.presence_reply
+    if not replies:
+        return
+
+    # Ignore users not in voice
+    if not after.voice or not after.voice.channel:
         return
 
-    # Ignore if activities haven't changed
-    if before.activities == after.activities:
+    # Skip games that were already announced for this member
+    games = [game for game in sorted(replies) if presence_announcements.should_announce(after.id, game)]
+    if not games:
         return
 
     # Load chat channel from config
@@ -321,49 +2408,37 @@ async def on_presence_update(before, after):
         print(f"Error: 'on_presence_update' could not find channel {config.MAIN_CHANNEL_ID}.")
         return
 
-    # Iterate through user's activities
-    for activity_after in after.activities:
-        if isinstance(activity_after, discord.Game):
-            
-            # --- THE DYNAMIC PART ---
-            # Check if the game name is in our config file
-            if activity_after.name in config.PRESENCE_JOKES:
-                
-                # Get the reply from config
-                reply = config.PRESENCE_JOKES[activity_after.name]
-                
-                # Send the reply
-                await channel_chat.send(f'{reply} <@{after.id}>')
+    for game in games:
+        send_to_channel(channel_chat, f'{replies[game]} <@{after.id}>', PRIORITY_JOKE)
 
 @bot.event
+@timed("event")
 async def on_message(msg):
-    # Respond to 'uwu' and 'nya'
+    # Respond to configured triggers (by default 'uwu' and 'nya')
     if msg.author.bot:
         return
-    if "uwu" in msg.content.lower():
-        await msg.channel.send("UwU!")
-    elif "nya" in msg.content.lower():
-        await msg.channel.send("Nyaaa~!")
+    reply = message_triggers.match(msg.content, msg.channel.id)
+    if reply:
+        await msg.channel.send(reply)
 
 @bot.event
+@timed("event")
 async def on_voice_state_update(member, before, after):
-    global voice_operation_in_progress
-    if not assert_voice_event_cooldown():
-        return
     if member.bot:
         return
-
+    # Steam monitors follow voice presence right away; greetings are coalesced
+    joined = voice_presence.update(member, before, after)
+    if joined is not None and config.STEAM_IDS.get(member.id):
+        if joined:
+            await steam_api_instance.start_monitor(member.id)
+        elif not voice_presence.in_any_guild(member.id):
+            # Still in voice in another guild (or hopped there before this leave arrived)
+            await steam_api_instance.stop_monitor(member.id)
+    voice_event_coalescer.submit(member, before, after)
+
+@timed("event", "voice_transition")
+async def handle_voice_transition(member, before, after):
     now = datetime.now()
-    current_time = now.strftime("%H:%M:%S")
-    
-    # --- NOTE: Time definitions could also be moved to config.py ---
-    start_m = datetime.strptime('07:00:00', '%H:%M:%S').time()
-    end_m = datetime.strptime('11:30:00', '%H:%M:%S').time()
-    start_nacht = datetime.strptime('20:00:00', '%H:%M:%S').time()
-    end_nacht = datetime.strptime('23:59:00', '%H:%M:%S').time()
-    start_nacht2 = datetime.strptime('00:01:00', '%H:%M:%S').time()
-    end_nacht2 = datetime.strptime('05:30:00', '%H:%M:%S').time()
-    current_time_obj = datetime.strptime(current_time, '%H:%M:%S').time()
 
     # --- NEW: Load Channel ID from config.py ---
     channel_chat = bot.get_channel(config.MAIN_CHANNEL_ID)
@@ -375,20 +2450,10 @@ async def on_voice_state_update(member, before, after):
     if before.channel is None and after.channel is not None:
         print(f"{member.name} joined voice channel {after.channel.name}.")
         
-        # --- NEW: Load STEAM_IDS from config.py ---
-        if member.id not in active_steam_monitors and config.STEAM_IDS.get(member.id):
-            print(f"User {member.name} joined VC. Starting Steam monitor task.")
-            # --- NEW: Pass Channel ID from config.py ---
-            task = bot.loop.create_task(steam_api_instance.monitor_single_steam_user(member.id, config.MAIN_CHANNEL_ID))
-            active_steam_monitors[member.id] = task
-
-        # --- NEW: Load GIF lists from config.py using general names ---
-        if start_m <= current_time_obj <= end_m:
-            await channel_chat.send(f"Mion! <@{member.id}>") # (You can customize this text)
-            await channel_chat.send(random.choice(config.GREETING_MORNING_GIFS))
-        else:
-            await channel_chat.send(f"Hamlo! <@{member.id}>") # (You can customize this text)
-            await channel_chat.send(random.choice(config.GGREETING_DAY_GIFS))
+        # --- NEW: Greeting text and GIF from config.py (VOICE_JOIN_MESSAGES) ---
+        greeting = voice_join_schedule.render(now, member.id)
+        if greeting:
+            send_to_channel(channel_chat, greeting)
         
         # (Your commented-out welcome sound code)
         # ...
@@ -397,34 +2462,27 @@ async def on_voice_state_update(member, before, after):
     elif before.channel is not None and after.channel is None:
         print(f"{member.name} left voice channel {before.channel.name}.")
 
-        if member.id in active_steam_monitors:
-            print(f"User {member.name} left VC. Stopping Steam monitor task.")
-            active_steam_monitors[member.id].cancel()
-            del active_steam_monitors[member.id]
-        
-        # --- NEW: Load GIF lists from config.py using general names ---
-        if (start_nacht <= current_time_obj <= end_nacht) or (start_nacht2 <= current_time_obj <= end_nacht2):
-            await channel_chat.send(f"GuNa! <@{member.id}>") # (You can customize this text)
-            await channel_chat.send(random.choice(config.FAREWELL_NIGHT_GIFS))
-        else:
-            await channel_chat.send(f"cu! <@{member.id}>") # (You can customize this text)
-            await channel_chat.send(random.choice(config.FAREWELL_DAY_GIFS))
+        # --- NEW: Farewell text and GIF from config.py (VOICE_LEAVE_MESSAGES) ---
+        farewell = voice_leave_schedule.render(now, member.id)
+        if farewell:
+            send_to_channel(channel_chat, farewell)
+
+voice_event_coalescer = VoiceEventCoalescer(handle_voice_transition)
 
 @bot.tree.command(name="witz", description="n witz")
 @app_commands.checks.cooldown(1, 120, key=interaction_user_key)
+@timed("command")
 async def witz(i: discord.Interaction):
-    try:
-        r = requests.get("https://witzapi.de/api/joke")
-        r.raise_for_status()
-        data = r.json()
-        await i.response.send_message(data[0]["text"])
-    except requests.exceptions.RequestException as e:
-        print(f"Error with joke API: {e}")
+    joke = await joke_buffer.get_joke()
+    if joke:
+        await i.response.send_message(joke)
+    else:
         await i.response.send_message("The joke API seems to be down. Try again later!")
 
 @bot.tree.command(name="reminder", description="Create a reminder")
 @app_commands.checks.cooldown(1, 20, key=interaction_user_key)
 @app_commands.describe(date="Date (YYYY-MM-DD)", time="Time (HH:MM)", message="Reminder text")
+@timed("command")
 async def reminder(interaction: discord.Interaction, date: str, time: str, message: str):
     try:
         reminder_time = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
@@ -439,25 +2497,48 @@ async def reminder(interaction: discord.Interaction, date: str, time: str, messa
         await interaction.response.send_message("The specified time is in the past.")
         return
 
+    await reminder_scheduler.schedule(interaction.user.id, reminder_time.timestamp(), message)
     await interaction.response.send_message(
         f"Reminder set for {reminder_time.strftime('%Y-%m-%d %H:%M')}.")
 
-    await asyncio.sleep(delta.total_seconds())
+@bot.tree.command(name="stats", description="Steam playtime per game")
+@app_commands.checks.cooldown(1, 10, key=interaction_user_key)
+@app_commands.describe(user="Whose playtime (default: you)", days="Only count the last N days (default: all time)")
+@timed("command")
+async def stats(interaction: discord.Interaction, user: discord.Member = None, days: app_commands.Range[int, 1, 3650] = None):
+    member = user or interaction.user
+    period = f"last {days} days" if days else "all time"
+    rows = await game_history.member_stats(member.id, days)
+    current = game_history.current_session(member.id)
+    if not rows and not current:
+        await interaction.response.send_message(f"No Steam playtime recorded for {member.display_name} ({period}).")
+        return
 
-    # --- NEW: Load Channel ID from config.py ---
-    channel_chat = bot.get_channel(config.MAIN_CHANNEL_ID)
-    if channel_chat:
-        await channel_chat.send(
-            f"{interaction.user.mention}, you wanted to be reminded of: **{message}**, Nyan~"
-        )
-    else:
-        try:
-            await interaction.user.send(f"Your reminder: **{message}**, Nyan~ (I couldn't find the channel, so here's a DM.)")
-        except discord.Forbidden:
-            print(f"Could not send reminder to {interaction.user.name} (channel not found and DMs closed).")
+    lines = [f"**{member.display_name}**'s Steam playtime ({period}):"]
+    lines += [f"{rank}. {game}: {format_playtime(seconds)} ({sessions} sessions)"
+              for rank, (game, seconds, sessions) in enumerate(rows, 1)]
+    if current:
+        lines.append(f"Currently playing {current[0]} for {format_playtime(current[1])}.")
+    await interaction.response.send_message("\n".join(lines))
+
+@bot.tree.command(name="topgames", description="Most played games on this server")
+@app_commands.checks.cooldown(1, 10, key=interaction_user_key)
+@app_commands.describe(days="Period in days (default: 7)")
+@timed("command")
+async def topgames(interaction: discord.Interaction, days: app_commands.Range[int, 1, 3650] = 7):
+    rows = await game_history.top_games(days)
+    if not rows:
+        await interaction.response.send_message(f"No Steam playtime recorded in the last {days} days.")
+        return
+
+    lines = [f"**Top games** (last {days} days):"]
+    lines += [f"{rank}. {game}: {format_playtime(seconds)} ({players} {'player' if players == 1 else 'players'})"
+              for rank, (game, seconds, players) in enumerate(rows, 1)]
+    await interaction.response.send_message("\n".join(lines))
 
 @bot.tree.command(name="choose", description="Bot randomly chooses an option (separate options with space)")
 @app_commands.checks.cooldown(1, 10, key=interaction_user_key)
+@timed("command")
 async def choose(i: discord.Interaction, optionen:str):
     options_list = [opt.strip() for opt in optionen.split()]
     if not options_list:
@@ -469,23 +2550,26 @@ async def choose(i: discord.Interaction, optionen:str):
 # --- NEW: Load role name from config.py ---
 @app_commands.checks.has_any_role(config.SOUND_ROLE_NAME)
 @app_commands.describe(sound="The sound you want to play")
+@timed("command", "playsound")
 async def playsound_command(interaction: discord.Interaction, sound: str):
     await interaction.response.defer(ephemeral=True)
     await play_sound_in_vc(interaction, sound)
 
 # Autocomplete function for the /playsound command
 @playsound_command.autocomplete("sound")
+@timed("autocomplete", "playsound")
 async def sound_autocomplete(
     interaction: discord.Interaction,
     current: str,
 ) -> List[app_commands.Choice[str]]:
     return [
         app_commands.Choice(name=sound_name, value=sound_name)
-        for sound_name in SOUNDS_LIST if current.lower() in sound_name.lower()
-    ][:25] # Return max 25 choices  
+        for sound_name in sound_catalogue.search(current, limit=25) # Return max 25 choices
+    ]
 
 @bot.tree.command(name="sync", description="Synchronizes slash commands (Admin Only).")
 @app_commands.checks.has_permissions(administrator=True)
+@timed("command", "sync")
 async def sync_commands(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
 
@@ -506,34 +2590,222 @@ async def sync_commands(interaction: discord.Interaction):
 
     sys.stdout.flush()
 
-# Function to run a simple health check server for cloud deployments
-def run_health_check_server():
-    port = int(os.environ.get("PORT", 8080))
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+# --- Health check / metrics server for cloud deployments ---
+# Runs on the bot's own event loop, so a blocked loop also fails the probes.
+async def healthz(request):
+    from aiohttp import web
+    if bot.is_closed():
+        return web.Response(status=503, text="closed\n")
+    return web.Response(text="ok\n")
+
+async def readyz(request):
+    from aiohttp import web
+    latency = bot.latency
+    if not bot.is_ready():
+        return web.Response(status=503, text="not ready\n")
+    if math.isnan(latency) or math.isinf(latency) or latency > READY_MAX_GATEWAY_LATENCY:
+        return web.Response(status=503, text=f"gateway latency too high: {latency}\n")
+    return web.Response(text=f"ready (gateway latency {latency * 1000:.0f} ms)\n")
+
+async def render_metrics() -> str:
+    latency = bot.latency
+    monitored_users = len(await state_store.hgetall(STEAM_MONITORS_KEY))
+    pending_reminders = await state_store.count_reminders()
+    lines = [
+        "# HELP dcbot_ready Whether the gateway connection is ready.",
+        "# TYPE dcbot_ready gauge",
+        f"dcbot_ready {1 if bot.is_ready() else 0}",
+        "# HELP dcbot_startup_seconds Time from process start to the first READY event.",
+        "# TYPE dcbot_startup_seconds gauge",
+        f"dcbot_startup_seconds {startup_ready_seconds if startup_ready_seconds is not None else 'NaN'}",
+        "# HELP dcbot_ready_events_total READY events received (1 + full reconnects).",
+        "# TYPE dcbot_ready_events_total counter",
+        f"dcbot_ready_events_total {ready_events}",
+        "# HELP dcbot_gateway_latency_seconds Heartbeat latency of the gateway connection.",
+        "# TYPE dcbot_gateway_latency_seconds gauge",
+        f"dcbot_gateway_latency_seconds {latency if math.isfinite(latency) else 'NaN'}",
+        "# HELP dcbot_event_loop_lag_seconds Delay of the last event loop lag sample.",
+        "# TYPE dcbot_event_loop_lag_seconds gauge",
+        f"dcbot_event_loop_lag_seconds {loop_monitor.last_lag}",
+        "# HELP dcbot_event_loop_lag_max_seconds Largest event loop lag seen since startup.",
+        "# TYPE dcbot_event_loop_lag_max_seconds gauge",
+        f"dcbot_event_loop_lag_max_seconds {loop_monitor.max_lag}",
+        "# HELP dcbot_event_loop_stalls_total Times the loop was blocked longer than the stall threshold.",
+        "# TYPE dcbot_event_loop_stalls_total counter",
+        f"dcbot_event_loop_stalls_total {loop_monitor.stalls}",
+    ]
+    if isinstance(bot, commands.AutoShardedBot):
+        lines += [
+            "# HELP dcbot_shard_latency_seconds Heartbeat latency per shard run by this process.",
+            "# TYPE dcbot_shard_latency_seconds gauge",
+        ]
+        lines += [f'dcbot_shard_latency_seconds{{shard="{shard_id}"}} {shard_latency if math.isfinite(shard_latency) else "NaN"}'
+                  for shard_id, shard_latency in bot.latencies]
+    lines += handler_latency.render(("kind", "name"))
+    lines += [
+        "# HELP dcbot_steam_monitored_users Users currently watched by the Steam poller.",
+        "# TYPE dcbot_steam_monitored_users gauge",
+        f"dcbot_steam_monitored_users {monitored_users}",
+        "# HELP dcbot_steam_poll_cycles_total Completed Steam poll cycles.",
+        "# TYPE dcbot_steam_poll_cycles_total counter",
+        f"dcbot_steam_poll_cycles_total {steam_api_instance.poll_cycles}",
+        "# HELP dcbot_steam_failed_requests_total Steam API requests that failed after retries.",
+        "# TYPE dcbot_steam_failed_requests_total counter",
+        f"dcbot_steam_failed_requests_total {steam_api_instance.failed_requests}",
+        "# HELP dcbot_steam_announcements_total Game announcements made by the Steam poller.",
+        "# TYPE dcbot_steam_announcements_total counter",
+        f"dcbot_steam_announcements_total {steam_api_instance.announcements}",
+        "# HELP dcbot_voice_sessions_active Guilds with an active voice session.",
+        "# TYPE dcbot_voice_sessions_active gauge",
+        f"dcbot_voice_sessions_active {sum(1 for session in voice_sessions.values() if session.mixer is not None)}",
+        "# HELP dcbot_voice_members Members in a voice channel per guild.",
+        "# TYPE dcbot_voice_members gauge",
+    ]
+    lines += [f'dcbot_voice_members{{guild="{guild_id}"}} {len(members)}' for guild_id, members in voice_presence.guilds.items()]
+    lines += [
+        "# HELP dcbot_voice_playing_sounds Sounds being mixed per guild.",
+        "# TYPE dcbot_voice_playing_sounds gauge",
+    ]
+    lines += [f'dcbot_voice_playing_sounds{{guild="{guild_id}"}} {len(session.mixer.playing()) if session.mixer else 0}'
+              for guild_id, session in voice_sessions.items()]
+    lines += [
+        "# HELP dcbot_reminders_pending Reminders waiting to be delivered.",
+        "# TYPE dcbot_reminders_pending gauge",
+        f"dcbot_reminders_pending {pending_reminders}",
+        "# HELP dcbot_joke_buffer_size Prefetched jokes ready for /witz.",
+        "# TYPE dcbot_joke_buffer_size gauge",
+        f"dcbot_joke_buffer_size {joke_buffer.queue.qsize()}",
+    ]
+    outbound = [
+        ("dcbot_outbound_queue_depth", "gauge", "queue_depth", "Messages waiting per channel."),
+        ("dcbot_outbound_sent_messages_total", "counter", "sent_messages", "Messages sent per channel (before merging)."),
+        ("dcbot_outbound_sent_batches_total", "counter", "sent_batches", "Discord messages sent per channel (after merging)."),
+        ("dcbot_outbound_dropped_messages_total", "counter", "dropped_messages", "Messages dropped because the queue was full."),
+        ("dcbot_outbound_send_latency_seconds", "gauge", "last_send_latency", "Enqueue-to-send latency of the last batch."),
+    ]
+    channel_metrics = {channel_id: dispatcher.metrics() for channel_id, dispatcher in channel_dispatchers.items()}
+    for metric_name, metric_type, key, description in outbound:
+        lines += [f"# HELP {metric_name} {description}", f"# TYPE {metric_name} {metric_type}"]
+        lines += [f'{metric_name}{{channel="{channel_id}"}} {values[key]}' for channel_id, values in channel_metrics.items()]
+    return "\n".join(lines) + "\n"
+
+async def metrics(request):
+    from aiohttp import web
+    return web.Response(text=await render_metrics(), content_type="text/plain", charset="utf-8")
+
+health_runner = None
+
+async def start_health_server():
+    global health_runner
+    if health_runner is not None:
+        return
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/", healthz)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics)
+    health_runner = web.AppRunner(app, access_log=None)
+    await health_runner.setup()
+    try:
+        await web.TCPSite(health_runner, "0.0.0.0", HEALTH_SERVER_PORT).start()
+        print(f"Health check server listening on 0.0.0.0:{HEALTH_SERVER_PORT}")
+    except OSError as e:
+        print(f"Failed to bind health check server on port {HEALTH_SERVER_PORT}: {e}")
+
+@bot.event
+async def setup_hook():
+    # Runs exactly once per process, after login and before the gateway connects.
+    # Everything started here survives reconnects.
+    await start_health_server() # Probes work during login
+    loop_monitor.start()
+    if profiler:
+        profiler.start()
+
+    # Initialize the shared HTTP session
+    await http_client.initialize_session()
+
+    # Start prefetching jokes for /witz
+    joke_buffer.start()
+
+    # Reload pending reminders and start delivering them
+    reminder_scheduler.start()
 
+    # With shared state any worker may become the cluster's Steam poller,
+    # even if none of the monitored users are on its shards
+    if state_store.shared:
+        steam_api_instance.start()
+
+    # Pick up changes to the game reactions in config.py without a restart
+    game_reactions.start()
+
+    # Write the Steam game history in batches
+    game_history.start()
+
+    # Index the available sounds in the background
+    bot.loop.create_task(load_sounds())
+    print(f"Startup complete after {time.monotonic() - STARTUP_STARTED:.2f}s, connecting to the gateway.")
+
+async def shutdown():
     try:
-        sock.bind(('0.0.0.0', port))
-        sock.listen(1)
-        print(f"Health check server listening on 0.0.0.0:{port}")
+        await game_history.close()
     except Exception as e:
-        print(f"Failed to bind health check server on port {port}: {e}")
-        return 
-
-    while True:
+        print(f"Error writing game history: {e}")
+    try:
+        await http_client.close()
+    except Exception as e:
+        print(f"Error closing Aiohttp ClientSession: {e}")
+    if health_runner is not None:
+        await health_runner.cleanup()
+    if profiler:
+        # Keep the samples taken since the last periodic write
+        profiler.flush()
+
+async def run_bot():
+    async with bot:
         try:
-            conn, addr = sock.accept()
-            conn.close()
-        except Exception as e:
-            print(f"Health check server error during accept/close: {e}")
-            time.sleep(1)
-
-# Run the health check server in a separate thread
-health_thread = threading.Thread(target=run_health_check_server, daemon=True)
-health_thread.start()
-
-# Start the bot
-if DISCORD_TOKEN:
-    bot.run(DISCORD_TOKEN)
-else:
-    print("Error: DISCORD_TOKEN environment variable not set.")
\ No newline at end of file
+            await bot.start(DISCORD_TOKEN)
+        finally:
+            await shutdown()
+
+def run_cluster():
+    # Cluster launcher: splits SHARD_COUNT into contiguous shard ranges and runs
+    # each range in its own copy of this script. Every worker gets its own
+    # health server port (PORT + worker index).
+    if not SHARD_COUNT or SHARD_COUNT == "auto":
+        print("Error: CLUSTER_WORKERS requires an explicit SHARD_COUNT.")
+        sys.exit(1)
+    if not STATE_STORE_URL:
+        print("Error: CLUSTER_WORKERS requires STATE_STORE_URL so the workers can share state.")
+        sys.exit(1)
+    import subprocess
+    shard_count = int(SHARD_COUNT)
+    workers = min(CLUSTER_WORKERS, shard_count)
+    processes = []
+    for index in range(workers):
+        shard_ids = range(index * shard_count // workers, (index + 1) * shard_count // workers)
+        env = dict(os.environ,
+                   SHARD_IDS=",".join(str(shard_id) for shard_id in shard_ids),
+                   CLUSTER_WORKERS="1",
+                   PORT=str(HEALTH_SERVER_PORT + index))
+        print(f"Starting worker {index} for shards {shard_ids.start}-{shard_ids.stop - 1}.")
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+    try:
+        exit_codes = [process.wait() for process in processes]
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        exit_codes = [process.wait() for process in processes]
+    sys.exit(max(exit_codes))
+
+# Start the bot (only when run as a script, so benchmark.py can import the handlers)
+if __name__ == "__main__":
+    if not DISCORD_TOKEN:
+        print("Error: DISCORD_TOKEN environment variable not set.")
+    elif CLUSTER_WORKERS > 1:
+        run_cluster()
+    else:
+        try:
+            asyncio.run(run_bot())
+        except KeyboardInterrupt:
+            pass
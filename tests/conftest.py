@@ -0,0 +1,28 @@
+import os
+import sys
+import types
+
+import pytest
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def main(tmp_path_factory):
+    # main.py needs a config module; build one from config.py.example like benchmark.py does
+    config = types.ModuleType("config")
+    config.__file__ = os.path.join(BOT_DIR, "config.py.example")
+    with open(config.__file__, encoding="utf-8") as f:
+        exec(compile(f.read(), config.__file__, "exec"), config.__dict__)
+    sys.modules["config"] = config
+
+    # Keep sounds/, the PCM cache and the SQLite files out of the repository
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("bot"))
+    os.environ.pop("DISCORD_TOKEN", None)
+    sys.path.insert(0, BOT_DIR)
+    try:
+        import main
+        yield main
+    finally:
+        os.chdir(cwd)
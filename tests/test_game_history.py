@@ -0,0 +1,120 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+DAY = 86400
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "game_history.db")
+
+
+def close(*histories):
+    for history in histories:
+        if history.db is not None:
+            history.executor.submit(history.db.close).result()
+
+
+def test_stats_on_a_worker_that_does_not_poll(main, db_path, monkeypatch):
+    # Two workers share the database; only the first one runs the poller
+    poller = main.GameHistory(db_path)
+    other = main.GameHistory(db_path)
+    start = time.time() - 2 * 3600
+
+    async def scenario():
+        monkeypatch.setattr(main.bot, "loop", asyncio.get_running_loop())
+        assert await other.member_stats(1) == [] # Opened before the game existed
+        poller.observe(1, "Brand New Game", start)
+        poller.observe(1, None, start + 3600)
+        await poller.flush()
+        assert await other.member_stats(1) == [("Brand New Game", 3600, 1)]
+        assert await other.member_stats(1, days=7) == [("Brand New Game", 3600, 1)]
+        assert await other.top_games(7) == [("Brand New Game", 3600, 1)]
+
+        # The poller moves to the other worker, which adds sessions for the same game
+        other.observe(2, "Brand New Game", start)
+        other.observe(2, None, start + 600)
+        await other.flush()
+        assert await poller.top_games(7) == [("Brand New Game", 4200, 2)]
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        close(poller, other)
+
+
+def test_rollups_and_current_session(main, db_path, monkeypatch):
+    history = main.GameHistory(db_path)
+    midnight = (time.time() // DAY) * DAY
+
+    async def scenario():
+        monkeypatch.setattr(main.bot, "loop", asyncio.get_running_loop())
+        # Sessions across midnight count on both days, but as a session only on the day they started
+        history.observe(1, "A", midnight - DAY - 1800)
+        history.observe(1, "B", midnight - DAY + 1800)
+        history.observe(1, "A", midnight - 600)
+        assert history.current_session(1)[0] == "A"
+        assert await history.member_stats(1) == [("B", DAY - 2400, 1), ("A", 3600, 1)]
+        assert await history.member_stats(1, days=1) == []
+        history.close_missing(set(), midnight + 300)
+        assert history.current_session(1) is None
+        assert await history.member_stats(1, days=1) == [("A", 300, 0)]
+        assert await history.member_stats(1, days=2) == [("B", DAY - 2400, 1), ("A", 1800 + 600 + 300, 1)]
+        assert await history.top_games(2) == [("B", DAY - 2400, 1), ("A", 2700, 1)]
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        close(history)
+
+
+def test_flush_does_not_block_the_event_loop(main, db_path, monkeypatch):
+    history = main.GameHistory(db_path)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        monkeypatch.setattr(main.bot, "loop", asyncio.get_running_loop())
+        history.observe(1, "A")
+        # Simulate a slow write (e.g. a long compaction) occupying the database thread
+        history.executor.submit(time.sleep, 0.3)
+        task = asyncio.ensure_future(ticker())
+        started = time.monotonic()
+        await history.flush()
+        assert time.monotonic() - started >= 0.25
+        task.cancel()
+        assert max(later - earlier for earlier, later in zip(ticks, ticks[1:])) < 0.1
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        close(history)
+
+
+def test_only_the_poller_compacts(main, db_path, monkeypatch):
+    history = main.GameHistory(db_path)
+    monkeypatch.setattr(main, "GAME_HISTORY_FLUSH_INTERVAL", 0.01)
+    monkeypatch.setattr(main, "state_store", types.SimpleNamespace(shared=True))
+    monkeypatch.setattr(main.steam_api_instance, "is_poller", False)
+
+    async def scenario():
+        monkeypatch.setattr(main.bot, "loop", asyncio.get_running_loop())
+        history.start()
+        await asyncio.sleep(0.1)
+        assert history.last_compaction == 0.0
+        main.steam_api_instance.is_poller = True
+        await asyncio.sleep(0.1)
+        assert history.last_compaction > 0.0
+        history.flush_task.cancel()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        close(history)
@@ -0,0 +1,41 @@
+import pytest
+
+
+@pytest.fixture
+def registry(main):
+    registry = main.GameReactionRegistry()
+    registry.load({
+        "EA SPORTS™ FIFA 26": {"steam_reply": "Fifa xD", "aliases": ["EA SPORTS FC 26"]},
+        "Counter-Strike 2": {"steam_reply": "5000 rating incoming"},
+        "Portal 2": {"steam_reply": "The cake is a lie"},
+        "Notepad++": {"presence_reply": "Don't edit too much, UwU"},
+    })
+    return registry
+
+
+def name_of(registry, game_name):
+    reaction = registry.lookup(game_name)
+    return reaction.name if reaction else None
+
+
+def test_exact_names_ignore_case_and_trademark_signs(registry):
+    assert name_of(registry, "EA SPORTS FIFA 26") == "EA SPORTS™ FIFA 26"
+    assert name_of(registry, "counter-strike 2") == "Counter-Strike 2"
+    assert name_of(registry, "NOTEPAD++") == "Notepad++"
+
+
+def test_other_versions_of_a_game_match(registry):
+    assert name_of(registry, "EA SPORTS™ FIFA 23") == "EA SPORTS™ FIFA 26"
+    assert name_of(registry, "EA SPORTS FIFA 27") == "EA SPORTS™ FIFA 26"
+    assert name_of(registry, "Counter-Strike 3") == "Counter-Strike 2"
+
+
+def test_aliases_match_with_any_version(registry):
+    assert name_of(registry, "EA SPORTS FC 26") == "EA SPORTS™ FIFA 26"
+    assert name_of(registry, "EA SPORTS FC 25") == "EA SPORTS™ FIFA 26"
+
+
+def test_a_name_without_a_version_does_not_match_a_sequel(registry):
+    assert name_of(registry, "Counter-Strike") is None
+    assert name_of(registry, "Portal") is None
+    assert name_of(registry, "EA SPORTS FIFA") is None
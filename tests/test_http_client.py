@@ -0,0 +1,246 @@
+import asyncio
+import socket
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+HOST = "127.0.0.1"
+BACKOFF_BASE = 0.05
+
+
+class StubServer:
+    # Local API stand-in that answers with the scripted (status, headers)
+    # responses in order, then 200, and records when each request arrived
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.request_times = []
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        self.request_times.append(time.monotonic())
+        status, headers = self.responses.pop(0) if self.responses else (200, {})
+        if status == 200:
+            return web.json_response({"ok": True})
+        return web.json_response({"error": status}, status=status, headers=headers)
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/api", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, HOST, 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{HOST}:{port}/api"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+    def gaps(self):
+        return [later - earlier for earlier, later in zip(self.request_times, self.request_times[1:])]
+
+
+def unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def client(main, monkeypatch):
+    # Fast, jitter-free backoff: every retry waits exactly BACKOFF_BASE * 2 ** attempt
+    monkeypatch.setattr(main, "HTTP_BACKOFF_BASE", BACKOFF_BASE)
+    monkeypatch.setattr(main, "HTTP_BACKOFF_MAX", 1.0)
+    monkeypatch.setattr(main.random, "uniform", lambda low, high: high)
+    client = main.HttpClient()
+    client.configure_host(HOST, rate=1000, capacity=100)
+    return client
+
+
+def run(coro_func, client):
+    async def wrapper():
+        try:
+            return await coro_func()
+        finally:
+            await client.close()
+    return asyncio.run(wrapper())
+
+
+def test_success_returns_json(client):
+    async def scenario():
+        async with StubServer() as server:
+            assert await client.get_json(server.url) == {"ok": True}
+            assert len(server.request_times) == 1
+    run(scenario, client)
+
+
+def test_5xx_is_retried_with_exponential_backoff(client):
+    async def scenario():
+        async with StubServer([(503, {}), (500, {})]) as server:
+            assert await client.get_json(server.url) == {"ok": True}
+            gaps = server.gaps()
+            assert len(gaps) == 2
+            for attempt, gap in enumerate(gaps):
+                expected = BACKOFF_BASE * 2 ** attempt
+                assert expected <= gap < expected + 0.1
+            assert client.breakers[HOST].state == "closed"
+    run(scenario, client)
+
+
+def test_429_honours_retry_after_and_slows_the_limiter(client):
+    async def scenario():
+        async with StubServer([(429, {"Retry-After": "0.3"})]) as server:
+            limiter = client.limiters[HOST]
+            assert await client.get_json(server.url) == {"ok": True}
+            [gap] = server.gaps()
+            assert 0.3 <= gap < 0.4
+            # Halved by the 429, then partly recovered by the successful retry
+            assert limiter.rate == pytest.approx(1000 / 2 + 1000 / 10)
+    run(scenario, client)
+
+
+def test_retry_after_blocks_concurrent_callers(client):
+    async def scenario():
+        async with StubServer([(429, {"Retry-After": "0.3"})]) as server:
+            first = asyncio.ensure_future(client.get_json(server.url))
+            while not server.request_times:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05) # The 429 has been handled and the limiter is blocked
+            await client.get_json(server.url)
+            await first
+            throttled_at = server.request_times[0]
+            assert all(at - throttled_at >= 0.3 for at in server.request_times[1:])
+    run(scenario, client)
+
+
+def test_4xx_is_not_retried(main, client):
+    async def scenario():
+        async with StubServer([(404, {}), (404, {})]) as server:
+            with pytest.raises(aiohttp.ClientResponseError) as excinfo:
+                await client.get_json(server.url)
+            assert excinfo.value.status == 404
+            assert len(server.request_times) == 1
+            assert client.breakers[HOST].failures == 0
+    run(scenario, client)
+
+
+def test_gives_up_after_max_retries(main, client):
+    async def scenario():
+        async with StubServer([(500, {})] * 10) as server:
+            with pytest.raises(aiohttp.ClientResponseError) as excinfo:
+                await client.get_json(server.url)
+            assert excinfo.value.status == 500
+            assert len(server.request_times) == main.HTTP_MAX_RETRIES + 1
+    run(scenario, client)
+
+
+def test_circuit_opens_for_a_down_host(main, client, monkeypatch):
+    monkeypatch.setattr(main, "HTTP_MAX_RETRIES", 0)
+    breaker = client.breakers[HOST] = main.CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+    url = f"http://{HOST}:{unused_port()}/api"
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(aiohttp.ClientConnectionError):
+                await client.get_json(url)
+        assert breaker.state == "open"
+        # Short-circuited without touching the network
+        with pytest.raises(main.CircuitOpenError):
+            await client.get_json(url)
+
+        # After the reset timeout one trial request is let through; it fails
+        # again, which re-opens the circuit for another full timeout
+        await asyncio.sleep(0.2)
+        assert breaker.state == "half-open"
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await client.get_json(url)
+        assert breaker.state == "open"
+    run(scenario, client)
+
+
+def test_half_open_trial_success_closes_the_circuit(main, client, monkeypatch):
+    monkeypatch.setattr(main, "HTTP_MAX_RETRIES", 0)
+    breaker = client.breakers[HOST] = main.CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+
+    async def scenario():
+        async with StubServer([(503, {}), (503, {})]) as server:
+            for _ in range(2):
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await client.get_json(server.url)
+            assert breaker.state == "open"
+            with pytest.raises(main.CircuitOpenError):
+                await client.get_json(server.url)
+            assert len(server.request_times) == 2
+
+            await asyncio.sleep(0.2)
+            assert breaker.state == "half-open"
+            assert await client.get_json(server.url) == {"ok": True}
+            assert breaker.state == "closed"
+            assert breaker.failures == 0
+    run(scenario, client)
+
+
+def test_half_open_lets_only_one_trial_through(main, client, monkeypatch):
+    monkeypatch.setattr(main, "HTTP_MAX_RETRIES", 0)
+    breaker = client.breakers[HOST] = main.CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+
+    async def scenario():
+        async with StubServer([(503, {})]) as server:
+            with pytest.raises(aiohttp.ClientResponseError):
+                await client.get_json(server.url)
+            await asyncio.sleep(0.2)
+            assert breaker.state == "half-open"
+
+            # Everyone arriving while the trial is in flight is still short-circuited
+            results = await asyncio.gather(*(client.get_json(server.url) for _ in range(5)), return_exceptions=True)
+            assert results[0] == {"ok": True}
+            assert all(isinstance(result, main.CircuitOpenError) for result in results[1:])
+            assert len(server.request_times) == 2
+            assert breaker.state == "closed"
+    run(scenario, client)
+
+
+def test_cancelled_trial_frees_the_half_open_slot(main, client, monkeypatch):
+    monkeypatch.setattr(main, "HTTP_MAX_RETRIES", 0)
+    breaker = client.breakers[HOST] = main.CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+
+    async def scenario():
+        async with StubServer([(503, {})]) as server:
+            with pytest.raises(aiohttp.ClientResponseError):
+                await client.get_json(server.url)
+            await asyncio.sleep(0.2)
+            trial = asyncio.ensure_future(client.get_json(server.url))
+            await asyncio.sleep(0)
+            trial.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await trial
+            assert not breaker.trial_in_flight
+            assert await client.get_json(server.url) == {"ok": True}
+    run(scenario, client)
+
+
+def test_token_bucket_spaces_requests(main):
+    async def scenario():
+        bucket = main.TokenBucket(rate=20, capacity=1)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        # The first token is already there, the next four take 1/20 s each
+        elapsed = time.monotonic() - started
+        assert 0.19 <= elapsed < 0.3
+        assert not bucket.try_acquire()
+    asyncio.run(scenario())
+
+
+def test_token_bucket_rate_adapts(main):
+    bucket = main.TokenBucket(rate=8)
+    for _ in range(10):
+        bucket.on_throttled()
+    assert bucket.rate == bucket.min_rate == 1
+    for _ in range(100):
+        bucket.on_success()
+    assert bucket.rate == bucket.max_rate
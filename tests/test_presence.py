@@ -0,0 +1,58 @@
+import asyncio
+import types
+
+import discord
+import pytest
+
+
+def spotify(track: str):
+    return discord.Activity(type=discord.ActivityType.listening, name="Spotify", state=track)
+
+
+@pytest.fixture
+def announcements(main, monkeypatch):
+    sent = []
+    channel = types.SimpleNamespace(id=main.config.MAIN_CHANNEL_ID)
+    monkeypatch.setattr(main, "presence_announcements", main.PresenceAnnouncements())
+    monkeypatch.setattr(main.bot, "get_channel", {channel.id: channel}.get)
+    monkeypatch.setattr(main, "send_to_channel", lambda channel, text, priority=None: sent.append(text))
+    return sent
+
+
+def member(activities, in_voice: bool = True):
+    voice = types.SimpleNamespace(channel=object()) if in_voice else None
+    return types.SimpleNamespace(id=1, bot=False, voice=voice, activities=tuple(activities))
+
+
+async def replay(main, updates):
+    before = member(())
+    for activities in updates:
+        after = member(activities)
+        await main.on_presence_update(before, after)
+        before = after
+
+
+def test_two_games_are_announced_once_each(main, announcements):
+    games = [discord.Game("Notepad++"), discord.Game("Fortnite")]
+    updates = [games + [spotify(f"track {index}")] for index in range(20)]
+    asyncio.run(replay(main, updates))
+    assert sorted(announcements) == ["Don't edit too much, UwU <@1>", "Haha Fortiniti <@1>"]
+
+
+def test_game_is_announced_again_after_the_ttl(main, announcements):
+    updates = [[discord.Game("Fortnite"), spotify("a")], [discord.Game("Fortnite"), spotify("b")]]
+    asyncio.run(replay(main, updates))
+    # Let the first announcement expire
+    announced = main.presence_announcements.announced
+    for key in announced:
+        announced[key] -= main.PRESENCE_ANNOUNCE_TTL
+    asyncio.run(replay(main, updates))
+    assert announcements == ["Haha Fortiniti <@1>"] * 2
+
+
+def test_members_not_in_voice_and_other_games_are_ignored(main, announcements):
+    async def scenario():
+        await main.on_presence_update(member(()), member([discord.Game("Fortnite")], in_voice=False))
+        await main.on_presence_update(member(()), member([discord.Game("Some Indie Game"), spotify("a")]))
+    asyncio.run(scenario())
+    assert announcements == []
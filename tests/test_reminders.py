@@ -0,0 +1,95 @@
+import asyncio
+import time
+import types
+
+import discord
+import pytest
+
+COALESCE_WINDOW = 0.05
+RETRY_DELAY = 0.1
+
+
+class FlakyChannel:
+    # Main channel stand-in whose first `failures` sends raise HTTPException
+    def __init__(self, channel_id: int, failures: int = 0):
+        self.id = channel_id
+        self.failures = failures
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise discord.HTTPException(types.SimpleNamespace(status=503, reason="Service Unavailable"), "unavailable")
+        self.sent.append(content)
+
+
+@pytest.fixture
+def scheduler(main, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "OUTBOUND_COALESCE_WINDOW", COALESCE_WINDOW)
+    monkeypatch.setattr(main, "REMINDER_RETRY_DELAY", RETRY_DELAY)
+    monkeypatch.setattr(main, "channel_dispatchers", {})
+    async def ready():
+        pass
+    monkeypatch.setattr(main.bot, "wait_until_ready", ready)
+    store = main.MemoryStateStore(str(tmp_path / "reminders.db"))
+    yield main.ReminderScheduler(store)
+    asyncio.run(store.close())
+
+
+def pending_rows(store):
+    # Straight from SQLite, on the thread that owns the connection
+    return store.executor.submit(lambda: store._open().execute("SELECT user_id, message FROM reminders").fetchall()).result()
+
+
+def run(main, monkeypatch, channel, scenario):
+    async def wrapper():
+        monkeypatch.setattr(main.bot, "loop", asyncio.get_running_loop())
+        monkeypatch.setattr(main.bot, "get_channel", {channel.id: channel}.get)
+        await scenario()
+    asyncio.run(wrapper())
+
+
+def test_reminder_stays_stored_until_it_was_sent(main, scheduler, monkeypatch):
+    channel = FlakyChannel(main.config.MAIN_CHANNEL_ID)
+
+    async def scenario():
+        await scheduler.schedule(1, time.time(), "stretch")
+        scheduler.start()
+        # Claimed and queued, but still inside the coalesce window: a restart
+        # now must not lose it
+        await asyncio.sleep(COALESCE_WINDOW / 2)
+        assert channel.sent == []
+        assert pending_rows(scheduler.store) == [(1, "stretch")]
+
+        await asyncio.sleep(COALESCE_WINDOW * 2)
+        assert channel.sent == ["<@1>, you wanted to be reminded of: **stretch**, Nyan~"]
+        assert pending_rows(scheduler.store) == []
+        scheduler.dispatcher_task.cancel()
+
+    run(main, monkeypatch, channel, scenario)
+
+
+def test_failed_send_is_retried(main, scheduler, monkeypatch):
+    channel = FlakyChannel(main.config.MAIN_CHANNEL_ID, failures=1)
+
+    async def scenario():
+        await scheduler.schedule(1, time.time(), "first")
+        await scheduler.schedule(2, time.time(), "second")
+        scheduler.start()
+        await asyncio.sleep(COALESCE_WINDOW * 2)
+        # Both went out in one (failed) send and were handed back to the heap
+        assert channel.sent == []
+        assert sorted(pending_rows(scheduler.store)) == [(1, "first"), (2, "second")]
+        assert await scheduler.store.count_reminders() == 2
+
+        await asyncio.sleep(RETRY_DELAY + COALESCE_WINDOW * 2)
+        assert channel.sent == [
+            "<@1>, you wanted to be reminded of: **first**, Nyan~\n"
+            "<@2>, you wanted to be reminded of: **second**, Nyan~"
+        ]
+        assert pending_rows(scheduler.store) == []
+        assert await scheduler.store.count_reminders() == 0
+        scheduler.dispatcher_task.cancel()
+
+    run(main, monkeypatch, channel, scenario)
+
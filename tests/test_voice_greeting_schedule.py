@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+
+
+def at(hour: int, minute: int, second: int = 0) -> datetime:
+    return datetime(2026, 1, 1, hour, minute, second)
+
+
+@pytest.mark.parametrize("time, expected", [
+    (at(6, 59, 59), "day"),
+    (at(7, 0), "morning"),
+    (at(11, 30), "morning"),
+    (at(11, 30, 1), "day"),
+])
+def test_window_ends_are_inclusive(main, time, expected):
+    schedule = main.VoiceGreetingSchedule([
+        {"start": "07:00", "end": "11:30", "text": "morning"},
+        {"text": "day"},
+    ])
+    assert schedule.lookup(time)["text"] == expected
+
+
+@pytest.mark.parametrize("time, expected", [
+    (at(19, 59, 59), "day"),
+    (at(20, 0), "night"),
+    (at(23, 59, 59), "night"),
+    (at(0, 0), "night"),
+    (at(5, 30), "night"),
+    (at(5, 30, 1), "day"),
+])
+def test_window_across_midnight(main, time, expected):
+    schedule = main.VoiceGreetingSchedule([
+        {"start": "20:00", "end": "05:30", "text": "night"},
+        {"text": "day"},
+    ])
+    assert schedule.lookup(time)["text"] == expected
+
+
+def test_earlier_windows_win_and_no_default_means_no_reply(main):
+    schedule = main.VoiceGreetingSchedule([
+        {"start": "22:00", "end": "02:00", "text": "late"},
+        {"start": "20:00", "end": "23:00", "text": "evening"},
+    ])
+    assert schedule.lookup(at(21, 0))["text"] == "evening"
+    assert schedule.lookup(at(22, 30))["text"] == "late"
+    assert schedule.lookup(at(1, 0))["text"] == "late"
+    assert schedule.lookup(at(12, 0)) is None
+    assert schedule.render(at(12, 0), 1) is None
+    assert schedule.render(at(1, 0), 1) == "late <@1>"
@@ -0,0 +1,118 @@
+import asyncio
+import types
+
+import pytest
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.voice_channels = [types.SimpleNamespace(members=[])]
+        self.stage_channels = []
+
+
+def voice_member(member_id: int, guild: FakeGuild):
+    return types.SimpleNamespace(id=member_id, bot=False, guild=guild)
+
+
+def state(channel=None):
+    return types.SimpleNamespace(channel=channel)
+
+
+@pytest.fixture
+def steam(main, monkeypatch, tmp_path):
+    steam = main.steam_api_instance
+    monkeypatch.setattr(main, "voice_presence", main.VoicePresenceIndex())
+    monkeypatch.setattr(steam, "store", main.MemoryStateStore(str(tmp_path / "reminders.db")))
+    monkeypatch.setattr(steam, "start", lambda: None) # No poller task
+    monkeypatch.setattr(main.voice_event_coalescer, "submit", lambda *args: None)
+    return steam
+
+
+@pytest.fixture
+def member_id(main):
+    return next(iter(main.config.STEAM_IDS))
+
+
+def test_ready_keeps_a_member_in_voice_in_another_guild(main, steam, member_id):
+    # In voice in guild A, also a member of guild B
+    guild_a, guild_b = FakeGuild(1), FakeGuild(2)
+    guild_a.voice_channels[0].members.append(voice_member(member_id, guild_a))
+
+    async def scenario():
+        for guild in (guild_a, guild_b):
+            main.voice_presence.rebuild(guild)
+        await steam.sync_voice()
+        assert await steam.store.hgetall(main.STEAM_MONITORS_KEY) == {str(member_id): "leer"}
+    asyncio.run(scenario())
+
+
+def test_ready_stops_monitors_of_members_who_left_while_disconnected(main, steam, member_id):
+    async def scenario():
+        await steam.start_monitor(member_id)
+        main.voice_presence.rebuild(FakeGuild(1))
+        await steam.sync_voice()
+        assert await steam.store.hgetall(main.STEAM_MONITORS_KEY) == {}
+    asyncio.run(scenario())
+
+
+def test_hop_between_guilds_with_late_leave_event(main, steam, member_id):
+    guild_a, guild_b = FakeGuild(1), FakeGuild(2)
+    channel_a, channel_b = object(), object()
+
+    async def scenario():
+        await main.on_voice_state_update(voice_member(member_id, guild_a), state(), state(channel_a))
+        # The join in B arrives before the leave in A
+        await main.on_voice_state_update(voice_member(member_id, guild_b), state(), state(channel_b))
+        await main.on_voice_state_update(voice_member(member_id, guild_a), state(channel_a), state())
+        assert await steam.store.hgetall(main.STEAM_MONITORS_KEY) == {str(member_id): "leer"}
+
+        await main.on_voice_state_update(voice_member(member_id, guild_b), state(channel_b), state())
+        assert await steam.store.hgetall(main.STEAM_MONITORS_KEY) == {}
+    asyncio.run(scenario())
+
+
+def test_poller_stops_announcing_when_its_lock_lapses_mid_cycle(main, steam, monkeypatch, tmp_path):
+    class SharedStore(main.MemoryStateStore):
+        # Grants the poller lock once; the renewal before the second batch fails
+        shared = True
+        grants = 1
+
+        async def acquire_lock(self, name, owner, ttl):
+            self.grants -= 1
+            return self.grants >= 0
+
+    store = SharedStore(str(tmp_path / "reminders.db"))
+    announced = []
+
+    async def get_player_summaries(steam_ids):
+        return {"response": {"players": [{"steamid": steam_id, "gameextrainfo": "Rocket League"} for steam_id in steam_ids]}}
+
+    async def announce_game(channel_chat, member_id, game_name):
+        announced.append(member_id)
+
+    async def ready():
+        pass
+
+    monkeypatch.setattr(steam, "store", store)
+    monkeypatch.setattr(steam, "get_player_summaries", get_player_summaries)
+    monkeypatch.setattr(steam, "announce_game", announce_game)
+    monkeypatch.setattr(main.config, "STEAM_IDS", {1: 101, 2: 102})
+    monkeypatch.setattr(main, "STEAM_API_MAX_IDS_PER_CALL", 1)
+    monkeypatch.setattr(main, "LEADER_LOCK_TTL", 0.01)
+    monkeypatch.setattr(main, "game_history", main.GameHistory(str(tmp_path / "history.db")))
+    monkeypatch.setattr(main.bot, "wait_until_ready", ready)
+    monkeypatch.setattr(main.bot, "get_channel", lambda channel_id: object())
+
+    async def scenario():
+        for member_id in (1, 2):
+            await store.hsetnx(main.STEAM_MONITORS_KEY, member_id, "leer")
+        cycles = steam.poll_cycles
+        poller = asyncio.ensure_future(steam.poll_steam_presences(main.config.MAIN_CHANNEL_ID))
+        await asyncio.sleep(0.1)
+        poller.cancel()
+        # Only the first batch ran under the lock; the cycle does not count
+        assert announced == [1]
+        assert not steam.is_poller
+        assert steam.poll_cycles == cycles
+    asyncio.run(scenario())
@@ -0,0 +1,59 @@
+import asyncio
+import types
+
+import discord
+import pytest
+
+
+class FakeVoiceClient:
+    # Connected voice client whose first `failures` play() calls raise
+    def __init__(self, channel, failures: int = 0):
+        self.channel = channel
+        self.failures = failures
+        self.source = None
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self.source is not None
+
+    def stop(self):
+        self.source = None
+
+    def play(self, source, after=None):
+        if self.failures:
+            self.failures -= 1
+            raise discord.opus.OpusNotLoaded()
+        self.source = source
+
+
+@pytest.fixture
+def session(main, monkeypatch):
+    channel = types.SimpleNamespace(id=1, name="voice")
+    guild = types.SimpleNamespace(id=1, voice_client=FakeVoiceClient(channel, failures=1))
+    session = main.VoiceSession(guild)
+    async def load(sound_path):
+        return main.PCMBufferSource(bytes(discord.opus.Encoder.FRAME_SIZE * 10))
+    monkeypatch.setattr(session, "_load", load)
+    return session
+
+
+def test_failed_play_does_not_leave_a_dead_mixer(main, session, monkeypatch):
+    channel = session.guild.voice_client.channel
+
+    async def scenario():
+        monkeypatch.setattr(main.bot, "loop", asyncio.get_running_loop())
+        with pytest.raises(discord.opus.OpusNotLoaded):
+            await session.play(channel, "a.wav", "a")
+        assert session.mixer is None
+        assert session.idle_task is not None
+
+        # The next sound starts a new mixer that is actually playing
+        assert await session.play(channel, "b.wav", "b") == 1
+        assert session.vc.source is session.mixer
+        assert session.idle_task is None
+        assert await session.play(channel, "c.wav", "c") == 2
+        assert session.mixer.playing() == ["b", "c"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import threading
+import time
+import urllib.request
+
+import pytest
+from aiohttp import web
+
+HOST = "127.0.0.1"
+API_LATENCY = 0.3 # Seconds the stub joke API takes per request
+MONITOR_INTERVAL = 0.01
+STALL_THRESHOLD = 0.1
+
+
+class SlowJokeServer:
+    # Slow joke API stand-in on its own thread and event loop, so a blocking
+    # client in the test's loop cannot stall the server as well
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runner = None
+        self.url = None
+        self.requests = 0
+
+    async def joke(self, request):
+        self.requests += 1
+        await asyncio.sleep(API_LATENCY)
+        return web.json_response([{"text": f"Joke #{self.requests}.{index}"} for index in range(5)])
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get("/api/joke", self.joke)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, HOST, 0)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    def __enter__(self):
+        self.thread.start()
+        port = asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        self.url = f"http://{HOST}:{port}/api/joke"
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class FakeResponse:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, content=None, **kwargs):
+        self.messages.append(content)
+
+class FakeInteraction:
+    def __init__(self):
+        self.response = FakeResponse()
+
+
+@pytest.fixture
+def server():
+    with SlowJokeServer() as server:
+        yield server
+
+
+async def measure_stalls(main, calls):
+    # Runs the /witz calls one after another while an EventLoopMonitor samples the loop
+    monitor = main.EventLoopMonitor(interval=MONITOR_INTERVAL, stall_threshold=STALL_THRESHOLD)
+    monitor.start()
+    await asyncio.sleep(MONITOR_INTERVAL * 2)
+    replies = []
+    for call in calls:
+        interaction = FakeInteraction()
+        await call(interaction)
+        replies.extend(interaction.response.messages)
+    await asyncio.sleep(MONITOR_INTERVAL * 2)
+    monitor.task.cancel()
+    return monitor, replies
+
+
+def test_witz_does_not_stall_the_event_loop(main, server, monkeypatch):
+    async def blocking_witz(i):
+        # The original /witz: a synchronous HTTP request inside the event loop
+        with urllib.request.urlopen(server.url, timeout=5) as response:
+            jokes = json.load(response)
+        await i.response.send_message(jokes[0]["text"])
+
+    async def scenario():
+        monkeypatch.setattr(main.bot, "loop", asyncio.get_running_loop())
+        http = main.HttpClient()
+        http.configure_host(HOST, rate=1000, capacity=100)
+        buffer = main.JokeBuffer(http, server.url)
+        monkeypatch.setattr(main, "joke_buffer", buffer)
+        try:
+            before, before_replies = await measure_stalls(main, [blocking_witz] * 3)
+
+            # Cold start: the buffer is still empty while the refill task
+            # fetches, so the first calls wait for the slow API, but without
+            # blocking the loop
+            buffer.start()
+            after, after_replies = await measure_stalls(main, [main.witz.callback] * 3)
+        finally:
+            buffer.refill_task.cancel()
+            await http.close()
+
+        print(f"\n/witz against a {API_LATENCY}s API: "
+              f"blocking request max loop lag {before.max_lag * 1000:.1f} ms ({before.stalls} stalls), "
+              f"shared aiohttp client {after.max_lag * 1000:.1f} ms ({after.stalls} stalls)")
+        assert len(before_replies) == len(after_replies) == 3
+        assert all(reply.startswith("Joke #") for reply in after_replies)
+        assert before.max_lag >= API_LATENCY * 0.9
+        assert before.stalls >= 1
+        assert after.max_lag < STALL_THRESHOLD / 2
+        assert after.stalls == 0
+
+    asyncio.run(scenario())
+
+
+def test_witz_answers_from_the_buffer_in_under_a_millisecond(main, server, monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(main.bot, "loop", asyncio.get_running_loop())
+        http = main.HttpClient()
+        http.configure_host(HOST, rate=1000, capacity=100)
+        buffer = main.JokeBuffer(http, server.url)
+        monkeypatch.setattr(main, "joke_buffer", buffer)
+        buffer.start()
+        try:
+            while not buffer.queue.full():
+                await asyncio.sleep(0.05)
+            durations = []
+            for _ in range(buffer.queue.maxsize):
+                interaction = FakeInteraction()
+                start = time.perf_counter()
+                await main.witz.callback(interaction)
+                durations.append(time.perf_counter() - start)
+                assert interaction.response.messages[0].startswith("Joke #")
+        finally:
+            buffer.refill_task.cancel()
+            await http.close()
+        assert max(durations) < 0.001
+
+    asyncio.run(scenario())